@@ -3,39 +3,30 @@
 Claude's query to other AI via the automation system
 Usage: python claude_query.py "your prompt here" [flow_name]
 """
-import requests
-import json
-import time
+import atexit
+import httpx
+import orjson
 import sys
 from pathlib import Path
 
 BASE_URL = "http://localhost:8000"
-
-def add_text(text):
-    """Add a text and get its ID"""
-    res = requests.post(f"{BASE_URL}/api/texts", json={"text": text})
-    return res.json()
-
-def get_flow(flow_name):
-    """Get flow by name"""
-    res = requests.get(f"{BASE_URL}/api/flows")
-    flows = res.json().get("flows", {})
-    return flows.get(flow_name)
-
-def execute_flow(actions, text_id, flow_name, group_name):
-    """Execute flow with modified text_id"""
-    # Replace text_id in paste and save_to_file actions
-    modified_actions = []
-    for a in actions:
-        if a.get("type") == "paste":
-            modified_actions.append({**a, "text_id": text_id})
-        elif a.get("type") == "save_to_file":
-            modified_actions.append({**a, "text_id": text_id, "flow_name": flow_name, "group_name": group_name})
-        else:
-            modified_actions.append(a)
-
-    res = requests.post(f"{BASE_URL}/api/execute", json={
-        "actions": modified_actions,
+CHAIN_INTERVAL = 0.5  # Delay between a paste and the click that follows it
+
+# Reuse one keep-alive connection pool for every call (poll_status runs for up to 30 min)
+CLIENT = httpx.Client(
+    base_url=BASE_URL,
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=5, max_connections=10),
+)
+atexit.register(CLIENT.close)
+
+def execute_with_text(text, flow_name):
+    """Register the prompt and execute a saved flow with it in a single request"""
+    res = CLIENT.post("/api/execute/with_text", json={
+        "text": text,
+        "flow_name": flow_name,
+        "chain_paste_clicks": True,
+        "chain_interval": CHAIN_INTERVAL,
         "interval": 2,
         "confidence": 0.95,
         "min_confidence": 0.7,
@@ -43,17 +34,33 @@ def execute_flow(actions, text_id, flow_name, group_name):
         "cursor_speed": 0.5,
         "start_delay": 3  # Give me time to switch windows
     })
-    return res.json()
+    if res.status_code == 404:
+        return None
+    return orjson.loads(res.content)
 
 def poll_status():
-    """Poll execution status until complete"""
-    while True:
-        res = requests.get(f"{BASE_URL}/api/execute/status")
-        status = res.json()
-        print(f"Progress: {status.get('current_step')}/{status.get('total_steps')}")
-        if not status.get("is_running"):
-            return status
-        time.sleep(2)
+    """Follow the server-sent status stream until execution finishes"""
+    status = {}
+    results = []
+    last_progress = None
+    with CLIENT.stream("GET", "/api/execute/stream", timeout=None) as res:
+        for line in res.iter_lines():
+            if not line.startswith("data:"):
+                continue  # keep-alive comments / blank separators
+            status = orjson.loads(line[len("data:"):])
+            results.extend(status.get("results", []))  # Each event only carries the new results
+            progress = (status.get("current_step"), status.get("total_steps"))
+            if progress != last_progress:
+                # Rewrite the same console line instead of printing a new one per update
+                sys.stdout.write(f"\rProgress: {progress[0]}/{progress[1]}")
+                sys.stdout.flush()
+                last_progress = progress
+            if not status.get("is_running"):
+                break
+    if last_progress is not None:
+        sys.stdout.write("\n")
+    status["results"] = results
+    return status
 
 if __name__ == "__main__":
     # Parse arguments
@@ -65,30 +72,20 @@ if __name__ == "__main__":
     my_question = sys.argv[1]
     flow_name = sys.argv[2] if len(sys.argv) > 2 else "通常プロンプト-Liner"
 
-    # Grok系フローの場合、日本語で回答するよう指示を追加
-    if "Grok" in flow_name or "grok" in flow_name:
-        my_question = my_question + "
-
-※日本語で回答してください。"
-        print("[Grok] 日本語回答指示を追加")
+    # Grok系フローの日本語回答指示は、サーバーが貼り付け時に追加する
 
     print(f"Prompt: {my_question[:50]}...")
-    result = add_text(my_question)
-    text_id = result.get("id")
-    print(f"Text ID: {text_id}")
 
-    # Get flow
-    flow = get_flow(flow_name)
-    if not flow:
+    # Register the text and execute (the server loads the flow itself)
+    print("Executing... (3 second delay)")
+    print(">>> SWITCH TO BROWSER NOW <<<")
+    exec_result = execute_with_text(my_question, flow_name)
+    if exec_result is None:
         print(f"Flow not found: {flow_name}")
         exit(1)
 
-    print(f"Flow: {flow_name} ({len(flow['actions'])} actions)")
-
-    # Execute
-    print("Executing... (3 second delay)")
-    print(">>> SWITCH TO BROWSER NOW <<<")
-    exec_result = execute_flow(flow["actions"], text_id, flow_name, flow.get("group", "ai-normal"))
+    print(f"Text ID: {exec_result.get('text_id')}")
+    print(f"Flow: {flow_name} ({exec_result.get('action_count')} actions)")
     print(f"Started: {exec_result}")
 
     # Poll for completion
@@ -5,14 +5,30 @@ FastAPI + PyAutoGUI
 
 import os
 import time
-import json
-import random
+import atexit
+import re
+import signal
+import asyncio
+import functools
+import threading
+import traceback
+import uuid
+import orjson
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, Response
 from pydantic import BaseModel
-import shutil
+import hashlib
+import aiofiles
+import cv2
+import mss
+import numpy as np
 import pyautogui
 import pyperclip
 import pygetwindow as gw
@@ -54,76 +70,147 @@ def restore_browser_window():
     except Exception as e:
         print(f'[WARN] ウィンドウ復元失敗: {e}')
 
-app = FastAPI(title="Simple Image Click")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時にテンプレート画像を先読みし、ログの書き込み係を起動する（終了時は残りのログを書き切る）"""
+    global log_queue
+    # 起動自体は待たせないよう、既定のスレッドプールで裏で読み込む
+    asyncio.get_running_loop().run_in_executor(None, prewarm_templates)
+    log_queue = asyncio.Queue()
+    flusher = asyncio.create_task(flush_log_queue())
+    yield
+    flusher.cancel()
+    try:
+        await flusher
+    except asyncio.CancelledError:
+        pass
 
-# 実行状態管理
-import threading
-import uuid
 
+app = FastAPI(title="Simple Image Click", lifespan=lifespan)
+# フロー・テキスト一覧などの大きなJSONを圧縮して返す（SSEはStarlette側で圧縮対象外）
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
+# 実行状態管理
 class ExecutionState:
     def __init__(self):
         self.is_running = False
-        self.abort_flag = False
+        self.abort_event = threading.Event()  # 中止時にset（待機中のスレッドをすぐ起こす）
         self.execution_id = None
         self.current_step = 0
         self.total_steps = 0
         self.results = []
+        self.progress = None  # 実行中アクションの途中経過（ループクリックの回数など）
         self.completed = False
         self.lock = threading.Lock()
+        self.listeners = []  # 状態変化を待つSSE購読者 [(loop, asyncio.Event)]
+        self.task = None  # 実行中のバックグラウンド処理（EXECUTION_EXECUTORのFuture）
 
     def start(self, total_steps: int) -> str:
         with self.lock:
+            # is_runningは中止しても実行スレッドがfinish()するまで立ったまま
+            # （先に次を始めると中止フラグが下りて前の実行が残りを続け、結果も新しい実行に混ざる）
             if self.is_running:
                 return None  # 既に実行中
             self.is_running = True
-            self.abort_flag = False
+            self.abort_event.clear()
             self.execution_id = str(uuid.uuid4())[:8]
             self.current_step = 0
             self.total_steps = total_steps
             self.results = []
+            self.progress = None
             self.completed = False
-            return self.execution_id
+        self.notify()
+        return self.execution_id
 
     def add_result(self, result: dict):
         with self.lock:
             self.results.append(result)
             self.current_step = len(self.results)
+            self.progress = None
+        self.notify()
+
+    def set_progress(self, message: str):
+        """実行中アクションの途中経過を更新（resultsには積まないのでステップ数はずれない）"""
+        with self.lock:
+            self.progress = message
+        self.notify()
 
     def finish(self):
         with self.lock:
             self.completed = True
             self.is_running = False
+        self.notify()
 
     def abort(self):
+        """中止フラグを立てる（is_runningは実行スレッドがfinish()で下ろす）"""
         with self.lock:
-            self.abort_flag = True
-            self.is_running = False
+            self.abort_event.set()
+        self.notify()
+
+    def subscribe(self) -> asyncio.Event:
+        """状態変化の通知を受け取るEventを登録（イベントループ側から呼ぶ）"""
+        event = asyncio.Event()
+        with self.lock:
+            self.listeners.append((asyncio.get_running_loop(), event))
+        return event
 
-    def get_status(self) -> dict:
+    def unsubscribe(self, event: asyncio.Event):
+        with self.lock:
+            self.listeners = [(loop, ev) for loop, ev in self.listeners if ev is not event]
+
+    def notify(self):
+        """購読者に状態変化を通知（実行スレッドからも呼べる）"""
+        with self.lock:
+            listeners = list(self.listeners)
+        for loop, event in listeners:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # ループが既に閉じている
+
+    def get_status(self, since: int = 0) -> dict:
+        """状態を返す（resultsはsince件目以降のみ。since_nextを次回のsinceに使う）"""
         with self.lock:
             return {
                 "is_running": self.is_running,
                 "execution_id": self.execution_id,
                 "current_step": self.current_step,
                 "total_steps": self.total_steps,
-                "results": list(self.results),
+                "results": self.results[since:],
+                "since_next": len(self.results),
+                "progress": self.progress,
                 "completed": self.completed,
-                "aborted": self.abort_flag
+                "aborted": self.abort_event.is_set()
             }
 
 execution_state = ExecutionState()
 
-# 後方互換用（古いコードで参照している場合）
-execution_abort_flag = False
 batch_abort_flag = False  # バッチ全体の中止フラグ
 
 # 設定
 IMAGES_DIR = Path(__file__).parent / "images"
 TEXTS_FILE = Path(__file__).parent / "texts.json"
+TEXTS_JOURNAL_FILE = Path(__file__).parent / "texts.jsonl"  # texts.json以降の追加・更新・削除の追記ログ
+TEXTS_JOURNAL_COMPACT_LIMIT = 200  # 追記ログがこの件数に達したらtexts.jsonに書き戻して空にする
 FLOWS_FILE = Path(__file__).parent / "flows.json"  # アクションフロー保存
 LOG_FILE = Path(__file__).parent / "batch_log.txt"  # バッチ実行ログ
+LOG_FLUSH_DELAY = 0.2  # /api/logのログをまとめて書くまでの待ち時間（秒）
+IMAGE_INDEX_FILE = IMAGES_DIR / ".index.json"  # 画像の重複チェック用 {sha256: ファイル名}
 DEFAULT_CLICK_INTERVAL = 2.0  # デフォルトのクリック間隔（秒）
 DEFAULT_WAIT_TIMEOUT = 1800.0  # デフォルトの待機タイムアウト（秒）= 30分
+WAIT_POLL_INITIAL = 0.1  # 画像待機の照合間隔の初期値（秒）
+WAIT_POLL_MAX = 2.0  # 消失待機の照合間隔の上限（秒）- 長い待機では照合回数を抑える
+WAIT_APPEAR_POLL_MAX = 1.0  # 出現待機の照合間隔の上限（秒）- 出たらすぐ次へ進めるよう短めにする
+WAIT_POLL_BACKOFF = 1.25  # 見つからない（状態が変わらない）たびに間隔を伸ばす倍率
+CURSOR_WIGGLE_INTERVAL = 0.5  # 待機中にカーソルを揺らす間隔（秒）- 照合の間隔とは独立
+CANCEL_WAIT_TIMEOUT = 5.0  # /api/execute/cancel で実行スレッドの停止を待つ上限（秒）
+
+# フロー実行専用のスレッド（1本だけ）
+# 中止後まだ抜けきっていない前回の実行があれば、次の実行はその後ろで待つ（マウス操作が並行しない）
+# APIのファイル入出力（asyncio.to_thread）は既定のスレッドプールを使うので巻き込まない
+EXECUTION_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="execute")
+UPLOAD_CHUNK_SIZE = 1 << 20  # アップロード書き込みの単位（1MB）
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")  # 対応画像形式（str.endswithにそのまま渡せるタプル）
 
 # PyAutoGUI設定
 pyautogui.FAILSAFE = True  # 画面左上にマウスを移動すると停止
@@ -131,7 +218,7 @@ pyautogui.FAILSAFE = True  # 画面左上にマウスを移動すると停止
 
 class ActionItem(BaseModel):
     """アクション項目"""
-    type: str  # "click", "paste", "paste_fixed", "wait", "click_or", "wait_disappear", "wait_seconds", "pagedown", "save_to_file"
+    type: str  # "click", "paste", "paste_fixed", "wait", "click_or", "wait_disappear", "wait_seconds", "pagedown", "save_to_file", "chain"
     image_name: str | None = None  # click, wait, wait_disappear で使用
     image_names: list[str] | None = None  # click_or で使用（複数画像）
     text_id: str | None = None  # paste, save_to_file で使用（8桁ID）
@@ -141,20 +228,44 @@ class ActionItem(BaseModel):
     count: int | None = None  # pagedown で使用（回数）
     flow_name: str | None = None  # save_to_file で使用（フロー名）- ファイル内ヘッダー用
     group_name: str | None = None  # save_to_file で使用（グループ名）- ファイル名用
+    sub_actions: list["ActionItem"] | None = None  # chain で使用（アクション間隔なしで連続実行）
+    chain_interval: float | None = None  # chain で使用（サブアクション間の待機秒数、省略時0）
+    loop_count: int | None = None  # loop_click で使用（クリック回数、省略時30）
+    loop_interval: float | None = None  # loop_click で使用（クリック間隔の秒数、省略時10）
 
 
-class ExecuteRequest(BaseModel):
-    """実行リクエスト"""
-    actions: list[ActionItem]
+class ExecuteSettings(BaseModel):
+    """実行設定（各実行リクエスト共通）"""
     interval: float = DEFAULT_CLICK_INTERVAL
     confidence: float = 0.95
     min_confidence: float = 0.7  # 最低認識精度（ここまで下げて試す）
     wait_timeout: float = DEFAULT_WAIT_TIMEOUT
     cursor_speed: float = 0.5  # カーソル移動速度（秒）
     start_delay: float = 0.0  # 開始前待機（秒）- 最初のアクション前に待つ
+
+
+class ExecuteRequest(ExecuteSettings):
+    """実行リクエスト"""
+    actions: list[ActionItem]
     flow_name: str | None = None  # フロー名（Grok日本語対応などで使用）
 
 
+class ExecuteByNameRequest(ExecuteSettings):
+    """保存済みフローの名前指定実行リクエスト"""
+    flow_name: str
+    text_id: str | None = None  # 指定時は paste / save_to_file のテキストIDを差し替え
+    chain_paste_clicks: bool = False  # 貼付の直後のクリックをchainにまとめる
+    chain_interval: float = 0.5  # chainにまとめた貼付→クリックの間隔（秒）
+
+
+class ExecuteWithTextRequest(ExecuteSettings):
+    """テキスト登録と保存済みフロー実行をまとめたリクエスト"""
+    text: str
+    flow_name: str
+    chain_paste_clicks: bool = False  # 貼付の直後のクリックをchainにまとめる
+    chain_interval: float = 0.5  # chainにまとめた貼付→クリックの間隔（秒）
+
+
 class ExecuteResult(BaseModel):
     """実行結果"""
     success: bool
@@ -163,30 +274,87 @@ class ExecuteResult(BaseModel):
 
 
 # テキスト管理（ID付き形式: {id: {id, text, created_at}}）
-def generate_text_id() -> str:
-    """8桁のユニークIDを生成"""
-    return str(random.randint(10000000, 99999999))
+TEXT_ID_MIN = 10000000  # 8桁IDの最小値
+
+
+def generate_text_id(texts: dict) -> str:
+    """8桁のユニークIDを採番（使用中IDの最大値+1、衝突時の再抽選は不要）
+
+    フローが参照しているIDも使用中とみなすので、削除済みテキストのIDを再利用して
+    古いフローが別のテキストを貼り付けることはない
+    """
+    used = max((int(text_id) for text_id in texts if text_id.isdigit()), default=TEXT_ID_MIN - 1)
+    return str(max(used, max_flow_text_id()) + 1)
+
+
+# テキストのメモリキャッシュ（texts.jsonのmtimeか追記ログのサイズが変わった時だけ読み直す）
+_texts_cache = {"signature": None, "data": {}, "journal_entries": 0, "body": None}  # bodyはGET /api/textsの応答本文
+texts_cache_lock = threading.Lock()  # APIのワーカースレッドと実行スレッドの両方から触るため
+# テキストの読み込み→変更→保存を直列化するロック
+texts_write_lock = asyncio.Lock()
+
+
+def texts_signature() -> tuple[int | None, int]:
+    """(texts.jsonのmtime, 追記ログのサイズ) - どちらも無ければ (None, 0)"""
+    try:
+        mtime = TEXTS_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    try:
+        journal_size = TEXTS_JOURNAL_FILE.stat().st_size
+    except FileNotFoundError:
+        journal_size = 0
+    return mtime, journal_size
+
+
+def apply_text_change(texts: dict, change: dict):
+    """追記ログの1件をテキスト一覧に反映する"""
+    if change["op"] == "put":
+        texts[change["id"]] = change["rec"]
+    elif change["op"] == "del":
+        texts.pop(change["id"], None)
 
 
 def load_texts() -> dict:
-    """テキスト一覧を読み込む（ID付き辞書形式）"""
-    if not TEXTS_FILE.exists():
-        return {}
-    with open(TEXTS_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        # 旧形式（リスト）からの移行対応
-        if isinstance(data, list):
-            return migrate_texts_to_id_format(data)
-        return data
+    """テキスト一覧を読み込む（ID付き辞書形式、texts.jsonに追記ログを再生したもの）"""
+    with texts_cache_lock:
+        signature = texts_signature()
+        if signature == _texts_cache["signature"]:
+            return dict(_texts_cache["data"])
+
+        data = {}
+        if signature[0] is not None:
+            with open(TEXTS_FILE, "rb") as f:
+                data = orjson.loads(f.read())
+        if not isinstance(data, list):
+            journal_entries = 0
+            broken = False
+            if signature[1]:
+                with open(TEXTS_JOURNAL_FILE, "rb") as f:
+                    for line in f:
+                        try:
+                            apply_text_change(data, orjson.loads(line))
+                        except (orjson.JSONDecodeError, KeyError):
+                            broken = True  # 書き込み途中で終了した行は捨てる
+                            continue
+                        journal_entries += 1
+            _texts_cache["data"] = data
+            _texts_cache["body"] = None
+            _texts_cache["signature"] = signature
+            _texts_cache["journal_entries"] = journal_entries
+            if broken:
+                # 壊れた行の後ろに追記すると次の変更まで読めなくなるので、書き戻してログを空にする
+                write_texts_snapshot()
+            return dict(data)
+    # 旧形式（リスト）からの移行対応（保存時にロックを取り直す）
+    return migrate_texts_to_id_format(data)
 
 
 def migrate_texts_to_id_format(old_texts: list[str]) -> dict:
     """旧形式（リスト）から新形式（ID付き辞書）に移行"""
     new_texts = {}
     for text in old_texts:
-        text_id = generate_text_id()
-        while text_id in new_texts:
-            text_id = generate_text_id()
+        text_id = generate_text_id(new_texts)
         new_texts[text_id] = {
             "id": text_id,
             "text": text,
@@ -197,10 +365,58 @@ def migrate_texts_to_id_format(old_texts: list[str]) -> dict:
     return new_texts
 
 
+def write_texts_snapshot():
+    """キャッシュの内容をtexts.jsonに書き、追記ログを空にする（texts_cache_lockを持って呼ぶ）
+
+    一時ファイルに書いてから置き換えるので書きかけのファイルは残らない。
+    置き換え後・ログを空にする前に落ちても、ログの再生は同じ結果になる
+    """
+    tmp_path = TEXTS_FILE.with_suffix(".json.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(_texts_cache["data"], option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    os.replace(tmp_path, TEXTS_FILE)
+    with open(TEXTS_JOURNAL_FILE, "wb"):
+        pass
+    _texts_cache["journal_entries"] = 0
+    _texts_cache["signature"] = texts_signature()
+
+
 def save_texts(texts: dict):
-    """テキスト一覧を保存"""
-    with open(TEXTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(texts, f, ensure_ascii=False, indent=2)
+    """テキスト一覧をまるごと保存"""
+    with texts_cache_lock:
+        _texts_cache["data"] = dict(texts)
+        _texts_cache["body"] = None
+        write_texts_snapshot()
+
+
+def record_text_change(op: str, text_id: str, record: dict | None = None):
+    """テキスト1件の追加・更新（op="put"）または削除（op="del"）を追記ログに書く
+
+    1件の変更でtexts.json全体を書き直さない。ログがTEXTS_JOURNAL_COMPACT_LIMIT件に
+    達したらtexts.jsonに書き戻す。load_textsで最新の状態を読んでから呼ぶ
+    """
+    change = {"op": op, "id": text_id}
+    if record is not None:
+        change["rec"] = record
+    with texts_cache_lock:
+        append_to_file(TEXTS_JOURNAL_FILE, orjson.dumps(change) + b"\n", keep_open=True)
+        apply_text_change(_texts_cache["data"], change)
+        _texts_cache["body"] = None
+        _texts_cache["journal_entries"] += 1
+        if _texts_cache["journal_entries"] >= TEXTS_JOURNAL_COMPACT_LIMIT:
+            write_texts_snapshot()
+        else:
+            _texts_cache["signature"] = texts_signature()
+
+
+def texts_response_body() -> tuple[str, bytes]:
+    """GET /api/textsの(ETag, 応答本文)（テキストが変わるまで同じバイト列を使い回す）"""
+    load_texts()  # ファイルが変わっていれば読み直す
+    with texts_cache_lock:
+        if _texts_cache["body"] is None:
+            _texts_cache["body"] = orjson.dumps({"texts": _texts_cache["data"]}, option=orjson.OPT_NON_STR_KEYS)
+        mtime, journal_size = _texts_cache["signature"] or (None, 0)
+        return f'W/"{mtime}-{journal_size}"', _texts_cache["body"]
 
 
 def get_text_by_id(texts: dict, text_id: str) -> str | None:
@@ -210,19 +426,76 @@ def get_text_by_id(texts: dict, text_id: str) -> str | None:
     return None
 
 
+# フローの読み込み→変更→保存を直列化するロック
+flows_write_lock = asyncio.Lock()
+
+
+# フローのメモリキャッシュ（ファイルのmtimeが変わった時だけ読み直す）
+_flows_cache = {"mtime": None, "data": {}, "body": None, "max_text_id": None}  # bodyはGET /api/flowsの応答本文
+flows_cache_lock = threading.Lock()
+
+
 # フロー管理
 def load_flows() -> dict:
-    """フロー一覧を読み込む"""
-    if not FLOWS_FILE.exists():
-        return {}
-    with open(FLOWS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """フロー一覧を読み込む（各フローは共有キャッシュなので、変更する時は複製してから）"""
+    with flows_cache_lock:
+        try:
+            mtime = FLOWS_FILE.stat().st_mtime_ns
+        except FileNotFoundError:
+            _flows_cache.update(mtime=None, data={}, body=None, max_text_id=None)
+            return {}
+        if mtime != _flows_cache["mtime"]:
+            with open(FLOWS_FILE, "rb") as f:
+                _flows_cache["data"] = orjson.loads(f.read())
+            _flows_cache["body"] = None
+            _flows_cache["max_text_id"] = None
+            _flows_cache["mtime"] = mtime
+        return dict(_flows_cache["data"])
+
+
+def flows_response_body() -> tuple[str, bytes]:
+    """GET /api/flowsの(ETag, 応答本文)（フローが変わるまで同じバイト列を使い回す）"""
+    load_flows()  # ファイルが変わっていれば読み直す
+    with flows_cache_lock:
+        if _flows_cache["body"] is None:
+            _flows_cache["body"] = orjson.dumps({"flows": _flows_cache["data"]}, option=orjson.OPT_NON_STR_KEYS)
+        return f'W/"{_flows_cache["mtime"]}"', _flows_cache["body"]
+
+
+def cached_json_response(request: Request, etag: str, body: bytes) -> Response:
+    """直列化済みのJSONを返す（ブラウザの持っている版と同じなら本文なしの304）"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def max_flow_text_id() -> int:
+    """フローが参照しているテキストIDの最大値（フローが変わるまで再計算しない）"""
+    load_flows()  # ファイルが変わっていれば読み直す
+    with flows_cache_lock:
+        if _flows_cache["max_text_id"] is None:
+            used = TEXT_ID_MIN - 1
+            for flow in _flows_cache["data"].values():
+                for action in flow.get("actions", []):
+                    text_id = action.get("text_id")
+                    if isinstance(text_id, str) and text_id.isdigit():
+                        used = max(used, int(text_id))
+            _flows_cache["max_text_id"] = used
+        return _flows_cache["max_text_id"]
 
 
 def save_flows(flows: dict):
-    """フロー一覧を保存"""
-    with open(FLOWS_FILE, "w", encoding="utf-8") as f:
-        json.dump(flows, f, ensure_ascii=False, indent=2)
+    """フロー一覧を保存（一時ファイルに書いてから置き換え）"""
+    tmp_path = FLOWS_FILE.with_suffix(".json.tmp")
+    with flows_cache_lock:
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(flows, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        os.replace(tmp_path, FLOWS_FILE)
+        _flows_cache["data"] = dict(flows)
+        _flows_cache["body"] = None
+        _flows_cache["max_text_id"] = None
+        _flows_cache["mtime"] = FLOWS_FILE.stat().st_mtime_ns
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -232,85 +505,115 @@ async def root():
     return FileResponse(html_path)
 
 
+# 画像ファイル名の一覧キャッシュ（imagesフォルダのmtimeが変わった時だけ再スキャン）
+_images_cache = {"mtime": None, "names": []}
+
+
 @app.get("/api/images")
 async def get_images():
     """imagesフォルダ内の画像一覧を返す"""
+    return {"images": await asyncio.to_thread(scan_images)}
+
+
+def scan_images() -> list[dict]:
+    """imagesフォルダを走査して画像一覧を作る（ブロッキング、スレッドで呼ぶ）"""
     if not IMAGES_DIR.exists():
         IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-        return {"images": []}
-
-    image_extensions = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
+        return []
+
+    # ファイル名の一覧はフォルダに変更がなければ前回のものを使う
+    dir_mtime = IMAGES_DIR.stat().st_mtime_ns
+    if dir_mtime != _images_cache["mtime"]:
+        # scandirならPathオブジェクトの生成や余分なstatなしで名前だけ見られる
+        with os.scandir(IMAGES_DIR) as entries:
+            # is_fileはscandirが取得済みの種別を使うので追加のstatは発生しない（フォルダを除外）
+            names = [entry.name for entry in entries
+                     if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file(follow_symlinks=False)]
+        names.sort()
+        _images_cache["names"] = names
+        _images_cache["mtime"] = dir_mtime
+
+    # 更新時刻をURLに含め、ブラウザには長期キャッシュさせる（差し替えるとURLが変わる）
+    # その場で上書きされた画像はフォルダの更新時刻が変わらないので、更新時刻は毎回取り直す
     images = []
-    for file in IMAGES_DIR.iterdir():
-        if file.suffix.lower() in image_extensions:
-            images.append({
-                "name": file.name,
-                "path": f"/images/{file.name}"
-            })
-
-    return {"images": sorted(images, key=lambda x: x["name"])}
+    for name in _images_cache["names"]:
+        try:
+            mtime = os.stat(IMAGES_DIR / name).st_mtime_ns
+        except FileNotFoundError:
+            continue  # 一覧を作った後に消された
+        images.append({"name": name, "path": f"/images/{name}?v={mtime}"})
+    return images
 
 
 @app.get("/api/texts")
-async def get_texts():
-    """テキスト一覧を返す"""
-    return {"texts": load_texts()}
+async def get_texts(request: Request):
+    """テキスト一覧を返す（変更がなければ直列化済みの本文をそのまま返す）"""
+    etag, body = await asyncio.to_thread(texts_response_body)
+    return cached_json_response(request, etag, body)
 
 
 @app.post("/api/texts")
 async def add_text(data: dict):
     """テキストを追加"""
-    text = data.get("text", "").strip()
+    text_id, texts = await store_text(data.get("text", ""))
+    return {"success": True, "id": text_id, "texts": texts}
+
+
+async def store_text(text: str) -> tuple[str, dict]:
+    """テキストを保存し、(新しいID, 保存後のテキスト一覧) を返す"""
+    text = text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="テキストが空です")
 
-    texts = load_texts()
-    text_id = generate_text_id()
-    while text_id in texts:
-        text_id = generate_text_id()
-
-    texts[text_id] = {
-        "id": text_id,
-        "text": text,
-        "created_at": time.strftime("%Y-%m-%d %H:%M:%S")
-    }
-    save_texts(texts)
-    return {"success": True, "id": text_id, "texts": texts}
+    async with texts_write_lock:
+        texts = await asyncio.to_thread(load_texts)
+        text_id = await asyncio.to_thread(generate_text_id, texts)
+
+        texts[text_id] = {
+            "id": text_id,
+            "text": text,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        await asyncio.to_thread(record_text_change, "put", text_id, texts[text_id])
+    return text_id, texts
 
 
 @app.put("/api/texts/{text_id}")
 async def update_text(text_id: str, data: dict):
     """テキストを更新"""
-    texts = load_texts()
-    if text_id not in texts:
-        raise HTTPException(status_code=404, detail="テキストが見つかりません")
+    async with texts_write_lock:
+        texts = await asyncio.to_thread(load_texts)
+        if text_id not in texts:
+            raise HTTPException(status_code=404, detail="テキストが見つかりません")
 
-    text = data.get("text", "").strip()
-    if not text:
-        raise HTTPException(status_code=400, detail="テキストが空です")
+        text = data.get("text", "").strip()
+        if not text:
+            raise HTTPException(status_code=400, detail="テキストが空です")
 
-    texts[text_id]["text"] = text
-    save_texts(texts)
+        texts[text_id] = {**texts[text_id], "text": text}
+        await asyncio.to_thread(record_text_change, "put", text_id, texts[text_id])
     return {"success": True, "texts": texts}
 
 
 @app.delete("/api/texts/{text_id}")
 async def delete_text(text_id: str):
     """テキストを削除"""
-    texts = load_texts()
-    if text_id not in texts:
-        raise HTTPException(status_code=404, detail="テキストが見つかりません")
+    async with texts_write_lock:
+        texts = await asyncio.to_thread(load_texts)
+        if text_id not in texts:
+            raise HTTPException(status_code=404, detail="テキストが見つかりません")
 
-    del texts[text_id]
-    save_texts(texts)
+        del texts[text_id]
+        await asyncio.to_thread(record_text_change, "del", text_id)
     return {"success": True, "texts": texts}
 
 
 # フローAPI
 @app.get("/api/flows")
-async def get_flows():
-    """フロー一覧を返す"""
-    return {"flows": load_flows()}
+async def get_flows(request: Request):
+    """フロー一覧を返す（変更がなければ直列化済みの本文をそのまま返す）"""
+    etag, body = await asyncio.to_thread(flows_response_body)
+    return cached_json_response(request, etag, body)
 
 
 @app.post("/api/flows")
@@ -325,56 +628,61 @@ async def save_flow(data: dict):
     if not actions:
         raise HTTPException(status_code=400, detail="アクションが空です")
 
-    flows = load_flows()
-    flows[name] = {
-        "actions": actions,
-        "group": group,
-        "created_at": time.strftime("%Y-%m-%d %H:%M:%S")
-    }
-    save_flows(flows)
+    async with flows_write_lock:
+        flows = await asyncio.to_thread(load_flows)
+        flows[name] = {
+            "actions": actions,
+            "group": group,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        await asyncio.to_thread(save_flows, flows)
     return {"success": True, "flows": flows}
 
 
 @app.delete("/api/flows/{flow_name}")
 async def delete_flow(flow_name: str):
     """フローを削除"""
-    flows = load_flows()
-    if flow_name not in flows:
-        raise HTTPException(status_code=404, detail=f"フローが見つかりません: {flow_name}")
+    async with flows_write_lock:
+        flows = await asyncio.to_thread(load_flows)
+        if flow_name not in flows:
+            raise HTTPException(status_code=404, detail=f"フローが見つかりません: {flow_name}")
 
-    del flows[flow_name]
-    save_flows(flows)
+        del flows[flow_name]
+        await asyncio.to_thread(save_flows, flows)
     return {"success": True, "flows": flows}
 
 @app.put("/api/flows/{flow_name}/group")
 async def change_flow_group(flow_name: str, data: dict):
     """フローのグループを変更"""
-    flows = load_flows()
-    if flow_name not in flows:
-        raise HTTPException(status_code=404, detail=f"フローが見つかりません: {flow_name}")
-
-    new_group = data.get("group", "")
-    flows[flow_name]["group"] = new_group
-
-    # save_to_fileアクションのgroup_nameも更新
-    for action in flows[flow_name].get("actions", []):
-        if action.get("type") == "save_to_file":
-            action["group_name"] = new_group
-
-    save_flows(flows)
+    async with flows_write_lock:
+        flows = await asyncio.to_thread(load_flows)
+        if flow_name not in flows:
+            raise HTTPException(status_code=404, detail=f"フローが見つかりません: {flow_name}")
+
+        new_group = data.get("group", "")
+        # キャッシュ上のフローを直接書き換えないよう複製して更新
+        # save_to_fileアクションのgroup_nameも更新
+        actions = [
+            {**action, "group_name": new_group} if action.get("type") == "save_to_file" else action
+            for action in flows[flow_name].get("actions", [])
+        ]
+        flows[flow_name] = {**flows[flow_name], "group": new_group, "actions": actions}
+
+        await asyncio.to_thread(save_flows, flows)
     return {"success": True, "flows": flows}
 
 @app.put("/api/flows/{flow_name}/suspend")
 async def toggle_flow_suspend(flow_name: str, data: dict):
     """フローの休止状態を変更"""
-    flows = load_flows()
-    if flow_name not in flows:
-        raise HTTPException(status_code=404, detail=f"フローが見つかりません: {flow_name}")
+    async with flows_write_lock:
+        flows = await asyncio.to_thread(load_flows)
+        if flow_name not in flows:
+            raise HTTPException(status_code=404, detail=f"フローが見つかりません: {flow_name}")
 
-    suspended = data.get("suspended", False)
-    flows[flow_name]["suspended"] = suspended
+        suspended = data.get("suspended", False)
+        flows[flow_name] = {**flows[flow_name], "suspended": suspended}
 
-    save_flows(flows)
+        await asyncio.to_thread(save_flows, flows)
     return {"success": True, "flows": flows}
 
 @app.get("/api/settings")
@@ -387,23 +695,53 @@ async def get_settings():
     }
 
 
+def cancel_pending_execution():
+    """実行スレッドの空きを待っている実行を取り消す（開始済みの実行は中止フラグで止まる）
+
+    戻り値: 取り消せたらTrue（開始済み・終了済みならFalse）
+    """
+    task = execution_state.task
+    if task is not None and task.cancel():
+        execution_state.finish()  # 実行スレッドが始まらないので、ここで終了扱いにする
+        return True
+    return False
+
+
 @app.post("/api/abort")
 async def abort_execution():
     """実行を中止（現在のフローのみ）"""
-    global execution_abort_flag
-    execution_abort_flag = True
     execution_state.abort()
-    print(f"[ABORT] 中止リクエスト受信: abort_flag={execution_state.abort_flag}, is_running={execution_state.is_running}")
+    cancel_pending_execution()
+    print(f"[ABORT] 中止リクエスト受信: aborted={execution_state.abort_event.is_set()}, is_running={execution_state.is_running}")
     return {"success": True, "message": "中止フラグを設定しました"}
 
 
+@app.post("/api/execute/cancel")
+async def cancel_execution():
+    """実行を中止し、実行スレッドが実際に止まるまで待つ"""
+    task = execution_state.task
+    if task is None or task.done():
+        return {"success": True, "message": "実行中のフローはありません", "stopped": True}
+
+    execution_state.abort()
+    if cancel_pending_execution():
+        return {"success": True, "message": "開始前の実行を取り消しました", "stopped": True}
+    # スレッドは強制終了できないため、各アクションの中止チェックで抜けるのを待つ
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(task)), timeout=CANCEL_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {"success": True, "message": "中止フラグを設定しました（実行スレッドはまだ停止していません）", "stopped": False}
+    print(f"[CANCEL] 実行を中止しました: execution_id={execution_state.execution_id}")
+    return {"success": True, "message": "実行を中止しました", "stopped": True}
+
+
 @app.post("/api/abort-all")
 async def abort_all_execution():
     """バッチ全体を中止（以降のフローも実行しない）"""
-    global execution_abort_flag, batch_abort_flag
-    execution_abort_flag = True
+    global batch_abort_flag
     batch_abort_flag = True
     execution_state.abort()
+    cancel_pending_execution()
     print(f"[ABORT-ALL] 全体中止リクエスト受信: batch_abort_flag={batch_abort_flag}")
     return {"success": True, "message": "バッチ全体の中止フラグを設定しました", "batch_aborted": True}
 
@@ -418,16 +756,42 @@ async def reset_batch():
 
 
 @app.get("/api/execute/status")
-async def get_execution_status():
-    """実行状態を取得"""
-    return execution_state.get_status()
+async def get_execution_status(since: int = 0):
+    """実行状態を取得（since指定時はその件数以降の結果だけ返す）"""
+    return execution_state.get_status(max(since, 0))
+
+
+@app.get("/api/execute/stream")
+async def stream_execution_status(since: int = 0):
+    """実行状態をServer-Sent Eventsで配信（ステップが進んだ時・終了時のみ送信、結果は前回送信分以降のみ）"""
+    async def event_generator():
+        changed = execution_state.subscribe()
+        next_index = max(since, 0)
+        try:
+            last_key = None
+            while True:
+                status = execution_state.get_status(next_index)
+                key = (status["current_step"], status["progress"], status["is_running"], status["completed"], status["aborted"])
+                if key != last_key:
+                    last_key = key
+                    next_index = status["since_next"]
+                    yield f"data: {orjson.dumps(status).decode()}\n\n"
+                if not status["is_running"]:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=15)
+                    changed.clear()
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"  # プロキシ等で切断されないように
+        finally:
+            execution_state.unsubscribe(changed)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @app.post("/api/force-quit")
 async def force_quit():
     """サーバーを強制終了（どうしても止まらない時用）"""
-    import os
-    import signal
     print("[FORCE-QUIT] 強制終了リクエスト受信。サーバーを終了します。")
     # 少し待ってからプロセスを終了（レスポンスを返すため）
     def delayed_exit():
@@ -437,26 +801,137 @@ async def force_quit():
     return {"success": True, "message": "サーバーを終了します。start.batで再起動してください。"}
 
 
+# 画像の重複チェック（内容のSHA-256 → ファイル名）
+def hash_image_file(path: Path) -> str:
+    """画像ファイルのSHA-256を計算"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_image_index() -> dict:
+    """画像インデックスを読み込む（なければ既存画像から作成）"""
+    if IMAGE_INDEX_FILE.exists():
+        with open(IMAGE_INDEX_FILE, "rb") as f:
+            return orjson.loads(f.read())
+
+    index = {}
+    for file in sorted(IMAGES_DIR.iterdir()):
+        if file.name.lower().endswith(IMAGE_EXTENSIONS):
+            index.setdefault(hash_image_file(file), file.name)
+    save_image_index(index)
+    return index
+
+
+def save_image_index(index: dict):
+    """画像インデックスを保存"""
+    with open(IMAGE_INDEX_FILE, "wb") as f:
+        f.write(orjson.dumps(index, option=orjson.OPT_INDENT_2))
+
+
+def remove_from_image_index(index: dict, image_name: str) -> dict:
+    """指定ファイル名を指すエントリをインデックスから除く"""
+    return {digest: name for digest, name in index.items() if name != image_name}
+
+
+# 画像インデックスの読み込み→変更→保存を直列化するロック
+images_write_lock = asyncio.Lock()
+
+
+def reserve_image_path(filename: str) -> Path:
+    """重複しない保存先を決めて空ファイルで確保する（同時アップロードで同じ名前を選ばない）"""
+    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    base, ext = Path(filename).stem, Path(filename).suffix
+    file_path = IMAGES_DIR / filename
+    counter = 1
+    while True:
+        try:
+            open(file_path, "xb").close()
+            return file_path
+        except FileExistsError:
+            file_path = IMAGES_DIR / f"{base}_{counter}{ext}"
+            counter += 1
+
+
+def register_uploaded_image(file_path: Path, digest: str) -> str | None:
+    """アップロード画像をインデックスに登録（同じ内容の既存画像があれば削除してその名前を返す）
+
+    imagesフォルダはAPIを通さずに上書きされることがあるので、インデックスを信用せず
+    既存画像の中身を読み直して同じ内容か確かめる（テンプレート画像は小さいので安い）
+    """
+    index = load_image_index()
+    existing_name = index.get(digest)
+    if existing_name and existing_name != file_path.name:
+        existing_path = IMAGES_DIR / existing_name
+        if existing_path.is_file() and hash_image_file(existing_path) == digest:
+            file_path.unlink()
+            return existing_name
+
+    index[digest] = file_path.name
+    save_image_index(index)
+    _images_cache["mtime"] = None  # 一覧キャッシュを破棄
+    return None
+
+
+def commit_replaced_image(tmp_path: Path, file_path: Path, digest: str) -> None:
+    """書き込み済みの差し替え画像で元の画像を置き換え、インデックスを新しい内容で更新する"""
+    os.replace(tmp_path, file_path)
+    index = remove_from_image_index(load_image_index(), file_path.name)
+    index.setdefault(digest, file_path.name)
+    save_image_index(index)
+    _images_cache["mtime"] = None  # 一覧キャッシュを破棄（URLの更新時刻を新しくする）
+
+
+async def stream_upload_to_file(file: UploadFile, file_path: Path) -> str:
+    """アップロード内容をチャンクごとに非同期で書き込み、SHA-256を返す"""
+    digest = hashlib.sha256()
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            # 書き込み（aiofilesのスレッド）を先に始め、その間にハッシュを計算する
+            write = asyncio.ensure_future(buffer.write(chunk))
+            digest.update(chunk)
+            await write
+    return digest.hexdigest()
+
+
+def remove_image(image_path: Path) -> None:
+    """画像ファイルを削除し、インデックスと一覧キャッシュから外す（画像がなければFileNotFoundError）"""
+    if not image_path.is_file():
+        raise FileNotFoundError(image_path)
+    image_path.unlink()
+    save_image_index(remove_from_image_index(load_image_index(), image_path.name))
+    _images_cache["mtime"] = None  # 一覧キャッシュを破棄
+
+
 @app.post("/api/upload")
 async def upload_image(file: UploadFile = File(...)):
     """画像をアップロードする"""
-    image_extensions = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
     ext = Path(file.filename).suffix.lower()
-    if ext not in image_extensions:
+    if ext not in IMAGE_EXTENSIONS:
         raise HTTPException(status_code=400, detail=f"対応していないファイル形式です: {ext}")
 
-    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-    file_path = IMAGES_DIR / file.filename
-
-    if file_path.exists():
-        base = Path(file.filename).stem
-        counter = 1
-        while file_path.exists():
-            file_path = IMAGES_DIR / f"{base}_{counter}{ext}"
-            counter += 1
+    file_path = await asyncio.to_thread(reserve_image_path, file.filename)
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # イベントループを止めないよう非同期でチャンクごとに書き込む（同時にハッシュを計算）
+    # 予約で作ったファイルは、途中で失敗したら書きかけのまま残さず消す
+    try:
+        digest = await stream_upload_to_file(file, file_path)
+    except BaseException:
+        await asyncio.to_thread(file_path.unlink, missing_ok=True)
+        raise
+
+    # 同じ内容の画像が既にあれば保存せず、既存のファイル名を返す
+    async with images_write_lock:
+        existing_name = await asyncio.to_thread(register_uploaded_image, file_path, digest)
+    if existing_name:
+        return {
+            "success": True,
+            "filename": existing_name,
+            "duplicate": True,
+            "message": f"同じ画像が既にあります: {existing_name}"
+        }
 
     return {
         "success": True,
@@ -469,16 +944,22 @@ async def upload_image(file: UploadFile = File(...)):
 async def replace_image(image_name: str, file: UploadFile = File(...)):
     """既存の画像を差し替える"""
     file_path = IMAGES_DIR / image_name
-    if not file_path.exists():
+    if not await asyncio.to_thread(file_path.is_file):
         raise HTTPException(status_code=404, detail=f"画像が見つかりません: {image_name}")
 
-    image_extensions = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
     ext = Path(file.filename).suffix.lower()
-    if ext not in image_extensions:
+    if ext not in IMAGE_EXTENSIONS:
         raise HTTPException(status_code=400, detail=f"対応していないファイル形式です: {ext}")
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # 一時ファイルへ非同期に書き込み、書き終えてから置き換える（途中で失敗しても元の画像は残る）
+    tmp_path = file_path.with_name(file_path.name + ".uploading")
+    try:
+        digest = await stream_upload_to_file(file, tmp_path)
+    except BaseException:
+        await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+        raise
+    async with images_write_lock:
+        await asyncio.to_thread(commit_replaced_image, tmp_path, file_path, digest)
 
     return {
         "success": True,
@@ -491,23 +972,34 @@ async def replace_image(image_name: str, file: UploadFile = File(...)):
 async def delete_image(image_name: str):
     """画像を削除する"""
     image_path = IMAGES_DIR / image_name
-    if not image_path.exists():
+    try:
+        async with images_write_lock:
+            await asyncio.to_thread(remove_image, image_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"画像が見つかりません: {image_name}")
-
-    image_path.unlink()
     return {"success": True, "message": f"削除しました: {image_name}"}
 
 
 def run_actions_in_background(request_dict: dict):
-    """バックグラウンドでアクションを実行"""
-    global execution_abort_flag
+    """バックグラウンドでアクションを実行（EXECUTION_EXECUTORのスレッドで呼ぶ）
 
+    Futureの結果は誰も読まないので、例外はここで表示して結果に残す。
+    どう終わってもウィンドウを戻してfinish()し、次の実行を受け付けられるようにする
+    """
+    try:
+        run_actions(request_dict)
+    except Exception as e:
+        print(f"[ERROR] 実行スレッドで例外: {traceback.format_exc()}")
+        execution_state.add_result({"status": "error", "message": f"[実行エラー] {type(e).__name__}: {e}"})
+    finally:
+        restore_browser_window()
+        execution_state.finish()
+
+
+def run_actions(request_dict: dict):
+    """アクションを順番に実行する（後片付けはrun_actions_in_backgroundが行う）"""
     texts = load_texts()
     actions = request_dict["actions"]
-    confidence = request_dict.get("confidence", 0.95)
-    min_confidence = request_dict.get("min_confidence", 0.7)
-    wait_timeout = request_dict.get("wait_timeout", DEFAULT_WAIT_TIMEOUT)
-    cursor_speed = request_dict.get("cursor_speed", 0.5)
     interval = request_dict.get("interval", DEFAULT_CLICK_INTERVAL)
     start_delay = request_dict.get("start_delay", 0.0)
 
@@ -521,172 +1013,482 @@ def run_actions_in_background(request_dict: dict):
                 flow_name_for_paste = a.get('flow_name')
                 break
 
+    prefetch_templates(actions)
+
     # ブラウザウィンドウを最小化
     minimize_browser_window()
     
     # 開始前待機
     if start_delay > 0:
         execution_state.add_result({"status": "info", "message": f"[開始待機] {start_delay}秒待機中..."})
-        time.sleep(start_delay)
-        # 待機後に中止されていないか確認
-        if execution_state.abort_flag or execution_abort_flag:
+        # 待機中に中止されたらすぐ抜ける
+        if execution_state.abort_event.wait(start_delay):
             execution_state.add_result({"status": "aborted", "message": f"[開始待機] 中止されました"})
-            restore_browser_window()
-            execution_state.finish()
             return
 
     for i, action_dict in enumerate(actions):
         # 中止チェック
-        if execution_state.abort_flag or execution_abort_flag:
+        if execution_state.abort_event.is_set():
             execution_state.add_result({"status": "aborted", "message": f"[中止] ユーザーにより中止されました"})
             break
 
-        action_type = action_dict.get("type")
-        image_name = action_dict.get("image_name")
-        image_names = action_dict.get("image_names")
-        text_id = action_dict.get("text_id")
-        fixed_text = action_dict.get("text")  # paste_fixed用
-        seconds = action_dict.get("seconds")
-        count = action_dict.get("count")
-        flow_name = action_dict.get("flow_name")
-        group_name = action_dict.get("group_name")
-        loop_count = action_dict.get("loop_count", 30)
-        loop_interval = action_dict.get("loop_interval", 10)
-
-        # エラー時に画像名を含めるためのコンテキスト情報
-        action_context = ""
-        if image_name:
-            action_context = image_name
-        elif image_names:
-            action_context = " / ".join(image_names)
+        result = run_single_action(action_dict, texts, request_dict, flow_name_for_paste)
+        execution_state.add_result(result)
 
-        try:
-            if action_type == "click":
-                result = execute_click(image_name, confidence, min_confidence)
-            elif action_type == "click_if_exists":
-                result = execute_click_if_exists(image_name, confidence, min_confidence)
-            elif action_type == "click_or":
-                result = execute_click_or(image_names, confidence, min_confidence)
-            elif action_type == "paste":
-                result = execute_paste(text_id, texts, flow_name_for_paste)
-            elif action_type == "paste_fixed":
-                result = execute_paste_fixed(fixed_text, flow_name_for_paste)
-            elif action_type == "wait":
-                result = execute_wait(image_name, confidence, wait_timeout, cursor_speed)
-            elif action_type == "wait_disappear":
-                result = execute_wait_disappear(image_name, confidence, wait_timeout, cursor_speed)
-            elif action_type == "wait_seconds":
-                result = execute_wait_seconds(seconds)
-            elif action_type == "pagedown":
-                result = execute_pagedown(count)
-            elif action_type == "save_to_file":
-                result = execute_save_to_file(text_id, flow_name, group_name, texts)
-            elif action_type == "loop_click":
-                result = execute_loop_click(image_name, confidence, min_confidence, loop_count, loop_interval, execution_state)
-            else:
-                result = {"status": "error", "message": f"不明なアクション: {action_type}"}
-
-            execution_state.add_result(result)
-
-            # 次のアクションまで待機（最後以外、成功時のみ）- 1秒刻みで中止チェック
-            if i < len(actions) - 1 and result["status"] == "success":
-                elapsed = 0
-                while elapsed < interval:
-                    if execution_abort_flag or execution_state.abort_flag:
-                        execution_state.add_result({"status": "aborted", "message": "[中止] アクション間待機中に中止されました"})
-                        execution_state.complete(False)
-                        return
-                    sleep_time = min(1.0, interval - elapsed)
-                    time.sleep(sleep_time)
-                    elapsed += sleep_time
-
-        except Exception as e:
-            import traceback
-            error_detail = traceback.format_exc()
-            print(f"エラー詳細: {error_detail}")
-            error_msg = f"エラー: {type(e).__name__}"
-            if action_context:
-                error_msg += f" ({action_context})"
-            tb_lines = error_detail.strip().split('\n')
-            if len(tb_lines) >= 2:
-                error_msg += f" [場所: {tb_lines[-2].strip()}]"
-            execution_state.add_result({"status": "error", "message": error_msg})
-
-    restore_browser_window()
-    execution_state.finish()
+        # 次のアクションまで待機（最後以外、成功時のみ）- 中止されたらすぐ抜ける
+        if i < len(actions) - 1 and result["status"] == "success":
+            if execution_state.abort_event.wait(interval):
+                execution_state.add_result({"status": "aborted", "message": "[中止] アクション間待機中に中止されました"})
+                return
 
 
-@app.post("/api/execute")
-async def execute_actions(request: ExecuteRequest):
-    """アクションを順番に実行する（バックグラウンド）"""
-    global execution_abort_flag, batch_abort_flag
-    
+def run_single_action(action_dict: dict, texts: dict, request_dict: dict, flow_name_for_paste: str = None) -> dict:
+    """アクションを1つ実行して結果を返す（ブロッキング、実行スレッド上で呼ぶ）"""
+    confidence = request_dict.get("confidence", 0.95)
+    min_confidence = request_dict.get("min_confidence", 0.7)
+    wait_timeout = request_dict.get("wait_timeout", DEFAULT_WAIT_TIMEOUT)
+    cursor_speed = request_dict.get("cursor_speed", 0.5)
+
+    action_type = action_dict.get("type")
+    image_name = action_dict.get("image_name")
+    image_names = action_dict.get("image_names")
+    text_id = action_dict.get("text_id")
+    fixed_text = action_dict.get("text")  # paste_fixed用
+    seconds = action_dict.get("seconds")
+    count = action_dict.get("count")
+    flow_name = action_dict.get("flow_name")
+    group_name = action_dict.get("group_name")
+    loop_count = action_dict.get("loop_count") or 30
+    loop_interval = action_dict.get("loop_interval")
+    if loop_interval is None:
+        loop_interval = 10
+
+    # エラー時に画像名を含めるためのコンテキスト情報
+    action_context = ""
+    if image_name:
+        action_context = image_name
+    elif image_names:
+        action_context = " / ".join(image_names)
+
+    try:
+        if action_type == "click":
+            return execute_click(image_name, confidence, min_confidence)
+        elif action_type == "click_if_exists":
+            return execute_click_if_exists(image_name, confidence, min_confidence)
+        elif action_type == "click_or":
+            return execute_click_or(image_names, confidence, min_confidence)
+        elif action_type == "paste":
+            return execute_paste(text_id, texts, flow_name_for_paste)
+        elif action_type == "paste_fixed":
+            return execute_paste_fixed(fixed_text, flow_name_for_paste)
+        elif action_type == "wait":
+            return execute_wait(image_name, confidence, wait_timeout, cursor_speed)
+        elif action_type == "wait_disappear":
+            return execute_wait_disappear(image_name, confidence, wait_timeout, cursor_speed)
+        elif action_type == "wait_seconds":
+            return execute_wait_seconds(seconds)
+        elif action_type == "pagedown":
+            return execute_pagedown(count)
+        elif action_type == "save_to_file":
+            return execute_save_to_file(text_id, flow_name, group_name, texts)
+        elif action_type == "loop_click":
+            return execute_loop_click(image_name, confidence, min_confidence, loop_count, loop_interval, execution_state)
+        elif action_type == "chain":
+            return execute_chain(action_dict.get("sub_actions"), action_dict.get("chain_interval"), texts, request_dict, flow_name_for_paste)
+        else:
+            return {"status": "error", "message": f"不明なアクション: {action_type}"}
+
+    except Exception as e:
+        error_detail = traceback.format_exc()
+        print(f"エラー詳細: {error_detail}")
+        error_msg = f"エラー: {type(e).__name__}"
+        if action_context:
+            error_msg += f" ({action_context})"
+        tb_lines = error_detail.strip().split('\n')
+        if len(tb_lines) >= 2:
+            error_msg += f" [場所: {tb_lines[-2].strip()}]"
+        return {"status": "error", "message": error_msg}
+
+
+def start_execution(actions: list[dict], settings: ExecuteSettings, flow_name: str | None = None) -> dict:
+    """アクション実行をバックグラウンドで開始する（イベントループ上で呼ぶ）"""
+
     # バッチ全体中止フラグが立っていたら即座に拒否
     if batch_abort_flag:
         raise HTTPException(status_code=409, detail="バッチ全体が中止されています。新しいバッチを開始するには /api/reset-batch を呼んでください。")
-    
-    execution_abort_flag = False  # 実行開始時にリセット
 
-    if not request.actions:
+    if not actions:
         raise HTTPException(status_code=400, detail="アクションが選択されていません")
 
     # 既に実行中かチェック
-    execution_id = execution_state.start(len(request.actions))
+    execution_id = execution_state.start(len(actions))
     if execution_id is None:
         raise HTTPException(status_code=409, detail="既に実行中です。完了を待つか中止してください。")
 
-    # リクエストを辞書に変換（スレッドに渡すため）
+    # スレッドに渡す辞書
     request_dict = {
-        "actions": [a.model_dump() for a in request.actions],
-        "confidence": request.confidence,
-        "min_confidence": request.min_confidence,
-        "wait_timeout": request.wait_timeout,
-        "cursor_speed": request.cursor_speed,
-        "interval": request.interval,
-        "start_delay": request.start_delay
+        "actions": actions,
+        "confidence": settings.confidence,
+        "min_confidence": settings.min_confidence,
+        "wait_timeout": settings.wait_timeout,
+        "cursor_speed": settings.cursor_speed,
+        "interval": settings.interval,
+        "start_delay": settings.start_delay,
+        "flow_name": flow_name
     }
 
-    # バックグラウンドスレッドで実行開始
-    thread = threading.Thread(target=run_actions_in_background, args=(request_dict,))
-    thread.start()
+    # 実行専用スレッドで開始（ブロッキング処理でループを止めない）
+    execution_state.task = EXECUTION_EXECUTOR.submit(run_actions_in_background, request_dict)
 
     # すぐにレスポンスを返す
     return {"status": "started", "execution_id": execution_id, "message": "実行を開始しました"}
 
 
-def find_best_match_confidence(image_path: str, target_confidence: float) -> tuple[float | None, any]:
-    """画像の最も近いマッチの信頼度を調べる（段階的に閾値を下げて検索）"""
-    # 設定した閾値で見つかるかチェック
+@app.post("/api/execute")
+async def execute_actions(request: ExecuteRequest):
+    """アクションを順番に実行する（バックグラウンド）"""
+    # アクション一覧（chainのsub_actionsも含む）を1回のmodel_dumpでまとめて辞書化する
+    actions = request.model_dump(include={"actions"})["actions"]
+    return start_execution(actions, request, request.flow_name)
+
+
+def prepare_flow_actions(flow: dict, flow_name: str, text_id: str | None = None) -> list[dict]:
+    """保存済みフローのアクションを実行用に複製し、テキストID・フロー名を差し替える"""
+    actions = []
+    for action in flow.get("actions", []):
+        if text_id and action.get("type") == "paste":
+            actions.append({**action, "text_id": text_id})
+        elif action.get("type") == "save_to_file":
+            patched = {**action, "flow_name": flow_name, "group_name": flow.get("group", "")}
+            if text_id:
+                patched["text_id"] = text_id
+            actions.append(patched)
+        else:
+            actions.append(dict(action))
+    return actions
+
+
+def chain_paste_clicks(actions: list[dict], chain_interval: float) -> list[dict]:
+    """貼付の直後のクリックを1つのchainにまとめる（アクション間隔を挟まない）"""
+    chained = []
+    i = 0
+    while i < len(actions):
+        action = actions[i]
+        next_action = actions[i + 1] if i + 1 < len(actions) else None
+        if action.get("type") in ("paste", "paste_fixed") and next_action and next_action.get("type") == "click":
+            chained.append({"type": "chain", "sub_actions": [action, next_action], "chain_interval": chain_interval})
+            i += 2
+        else:
+            chained.append(action)
+            i += 1
+    return chained
+
+
+@app.post("/api/execute/by_name")
+async def execute_flow_by_name(request: ExecuteByNameRequest):
+    """保存済みフローを名前で実行する（アクション一覧の取得・送信を省略）"""
+    flow = (await asyncio.to_thread(load_flows)).get(request.flow_name)
+    if flow is None:
+        raise HTTPException(status_code=404, detail=f"フローが見つかりません: {request.flow_name}")
+
+    actions = prepare_flow_actions(flow, request.flow_name, request.text_id)
+    if request.chain_paste_clicks:
+        actions = chain_paste_clicks(actions, request.chain_interval)
+
+    result = start_execution(actions, request, request.flow_name)
+    # chainにまとめた後の件数（進捗のtotal_stepsと揃える）
+    return {**result, "flow_name": request.flow_name, "action_count": len(actions)}
+
+
+@app.post("/api/execute/with_text")
+async def execute_flow_with_text(request: ExecuteWithTextRequest):
+    """テキストを登録し、そのテキストで保存済みフローを実行する（1リクエストで完結）"""
+    # フローが無いのにテキストだけ残らないよう、先に存在確認する
+    flow = (await asyncio.to_thread(load_flows)).get(request.flow_name)
+    if flow is None:
+        raise HTTPException(status_code=404, detail=f"フローが見つかりません: {request.flow_name}")
+
+    text_id, _ = await store_text(request.text)
+    actions = prepare_flow_actions(flow, request.flow_name, text_id)
+    if request.chain_paste_clicks:
+        actions = chain_paste_clicks(actions, request.chain_interval)
+
     try:
-        location = pyautogui.locateCenterOnScreen(image_path, confidence=target_confidence)
-        if location is not None:
-            return target_confidence, location
-    except pyautogui.ImageNotFoundException:
-        pass
-    except Exception:
-        pass
+        result = start_execution(actions, request, request.flow_name)
+    except HTTPException:
+        # 実行中・バッチ中止などで開始できなかった時は、登録したテキストを残さない
+        async with texts_write_lock:
+            await asyncio.to_thread(record_text_change, "del", text_id)
+        raise
+    # chainにまとめた後の件数（進捗のtotal_stepsと揃える）
+    return {**result, "text_id": text_id, "flow_name": request.flow_name, "action_count": len(actions)}
+
+
+# テンプレートをキャッシュしておく画像の数（LRU）
+TEMPLATE_CACHE_SIZE = 64
+# テンプレートの縮小段数（元解像度, 1/2, 1/4）
+TEMPLATE_PYRAMID_LEVELS = 3
+
+# 粗い照合で元解像度の再照合に回す候補の最大数（似た見た目のボタンが並ぶ場合の取りこぼし防止）
+# 縮小画像では細かい模様や文字の一致度が大きく下がる（本物の位置でも0.5前後になる）ため、
+# 粗い一致度で候補を足切りせず、上位の候補は必ず元解像度で確かめる
+COARSE_CANDIDATES = 3
+# 見つからなかった時の診断で「どの程度似ているか」を調べる下限の一致度
+DIAGNOSTIC_MIN_CONFIDENCE = 0.3
+
+# 前回見つかった位置の周辺だけを先に照合し、この一致度以上ならそのまま採用する
+# （診断用の低い閾値で呼ばれても、移動先ではなく元の位置の弱い一致を拾わないよう高めにする）
+LAST_MATCH_ACCEPT = 0.9
+
+# 複数テンプレートの並列照合用（cv2.matchTemplateは実行中GILを解放するので、コア数まで並列に効く）
+MATCH_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="match")
+
+
+def build_pyramid(image: np.ndarray, count: int = TEMPLATE_PYRAMID_LEVELS) -> tuple[np.ndarray, ...]:
+    """元画像と1/2, 1/4縮小画像のタプルを作る（countで段数を減らせる）"""
+    levels = [image]
+    for _ in range(count - 1):
+        levels.append(cv2.pyrDown(levels[-1]))
+    return tuple(levels)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def decode_template(path: str, mtime_ns: int) -> tuple[np.ndarray, ...] | None:
+    """テンプレート画像をグレースケールで読み込み、縮小画像も作っておく
+
+    mtime_nsもキーに含めるので、画像を差し替えると自動的に読み直す
+    """
+    # cv2.imreadはWindowsで日本語を含むパスを開けないため、バイト列を読んでからデコードする
+    # （memmapだとWindowsではマップ中のファイルを差し替えられないので、一括で読み込む）
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    template = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if template is None:
+        return None
+    pyramid = build_pyramid(template)
+    for level in pyramid:
+        level.setflags(write=False)  # キャッシュを共有するので書き換え禁止
+    return pyramid
+
+
+def load_template(image_path: Path) -> tuple[np.ndarray, ...] | None:
+    """テンプレート画像を縮小画像付きで取得（デコード結果はLRUキャッシュ）"""
+    return decode_template(str(image_path), image_path.stat().st_mtime_ns)
+
+
+def prewarm_templates():
+    """imagesフォルダの画像をテンプレートキャッシュに読み込む（新しい順にキャッシュ上限まで）"""
+    try:
+        with os.scandir(IMAGES_DIR) as entries:
+            images = [entry for entry in entries if entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+    except FileNotFoundError:
+        return
+    images.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+    # 古い順にデコードし、よく使われやすい新しい画像がLRUの末尾（最後に追い出される側）に来るようにする
+    for entry in reversed(images[:TEMPLATE_CACHE_SIZE]):
+        decode_template(entry.path, entry.stat().st_mtime_ns)
+    print(f"[INFO] テンプレート画像を先読みしました: {min(len(images), TEMPLATE_CACHE_SIZE)}件")
+
+
+def prefetch_templates(actions: list[dict]):
+    """実行するアクションが使う画像のデコードを裏で始めておく（最初のアクションまでの待ち時間に済ませる）
+
+    先読み後に追加・差し替えた画像やキャッシュから追い出された画像が対象。
+    画像がない等の失敗は無視する（そのアクションの実行時に通常どおり報告される）
+    """
+    # by_name/with_textのフローはflows.jsonの内容を検証せずに使うので、形が崩れていても実行を止めない
+    try:
+        names = set()
+        for action in actions:
+            for item in [action, *(action.get("sub_actions") or [])]:
+                names.add(item.get("image_name"))
+                names.update(item.get("image_names") or [])
+        for name in names:
+            if isinstance(name, str) and name:
+                MATCH_EXECUTOR.submit(load_template, IMAGES_DIR / name)
+    except Exception as e:
+        print(f"[WARN] 画像の先読みをスキップしました: {type(e).__name__}: {e}")
 
-    # 見つからない場合、閾値を下げて検索
-    test_confidences = [0.7, 0.6, 0.5, 0.4, 0.3]
-    for conf in test_confidences:
-        if conf >= target_confidence:
-            continue
-        try:
-            location = pyautogui.locateCenterOnScreen(image_path, confidence=conf)
-            if location is not None:
-                # この閾値で見つかった = 実際の信頼度はこの値以上、次の値未満
-                return conf, location
-        except pyautogui.ImageNotFoundException:
-            pass
-        except Exception:
-            pass
 
-    return None, None
+def grab_screen_gray(sct) -> tuple[np.ndarray, tuple[int, int]]:
+    """プライマリモニターをグレースケールで取得（画像, 左上のスクリーン座標）"""
+    monitor = sct.monitors[1]
+    shot = sct.grab(monitor)
+    # 生のBGRAバッファをコピーせずに配列として見せ、変換はOpenCVのSIMD実装に任せる
+    bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+    screen = cv2.cvtColor(bgra, cv2.COLOR_BGRA2GRAY)
+    return screen, (monitor["left"], monitor["top"])
+
+
+def capture_screen() -> tuple[tuple[np.ndarray, ...], tuple[int, int]]:
+    """画面を撮影して縮小画像付きで返す
+
+    戻り値: (build_pyramidの縮小画像付きタプル, 左上のスクリーン座標)
+    """
+    with mss.mss() as sct:
+        screen, offset = grab_screen_gray(sct)
+    return build_pyramid(screen), offset
+
+
+def coarse_level(template: tuple[np.ndarray, ...]) -> int:
+    """粗い照合に使う縮小段（0なら元解像度のみ）"""
+    th, tw = template[0].shape[:2]
+    if th >= 32 and tw >= 32:
+        return 2
+    if th >= 16 and tw >= 16:
+        return 1
+    return 0  # 小さい画像は縮小すると特徴が潰れるので元解像度のみ
+
+
+def match_template(screen: tuple[np.ndarray, ...], template: tuple[np.ndarray, ...], confidence: float, min_confidence: float | None = None) -> tuple[float, tuple[int, int] | None]:
+    """画面内のテンプレートを探す（縮小画像で粗く探し、候補周辺だけ元解像度で照合）
+
+    screen, templateはbuild_pyramid / load_templateの縮小画像付きタプル。
+    テンプレートが32px以上なら1/4、16px以上なら1/2の段で粗く探し、
+    一致度の高い候補（COARSE_CANDIDATES個）の周辺をすべて元解像度で照合して最大値を取る。
+    どの候補もconfidenceに届かなければ、縮小で取りこぼしていないか画面全体を元解像度で照合し直す。
+    戻り値: (一致度, 中心座標) - min_confidence（省略時はconfidence）未満なら中心座標はNone
+    """
+    full_screen, full = screen[0], template[0]
+    th, tw = full.shape[:2]
+    sh, sw = full_screen.shape[:2]
+    if th > sh or tw > sw:
+        return 0.0, None
+
+    levels = coarse_level(template)
+
+    if levels:
+        coarse = cv2.matchTemplate(screen[levels], template[levels], cv2.TM_CCOEFF_NORMED)
+        scale = 1 << levels
+        pad = scale * 2
+        coarse_th, coarse_tw = template[levels].shape[:2]
+        max_val, max_loc = None, None
+        for _ in range(COARSE_CANDIDATES):
+            _, _, _, coarse_loc = cv2.minMaxLoc(coarse)
+            # 候補の周辺（縮小による誤差分の余白付き）だけを元解像度で照合
+            x0 = max(0, coarse_loc[0] * scale - pad)
+            y0 = max(0, coarse_loc[1] * scale - pad)
+            roi = full_screen[y0:min(sh, coarse_loc[1] * scale + th + pad), x0:min(sw, coarse_loc[0] * scale + tw + pad)]
+            _, val, _, loc = cv2.minMaxLoc(cv2.matchTemplate(roi, full, cv2.TM_CCOEFF_NORMED))
+            if max_val is None or val > max_val:
+                max_val, max_loc = val, (loc[0] + x0, loc[1] + y0)
+            # 最初に閾値を超えた候補で打ち切らない（似たボタンが先に見つかっても、より一致する候補を選ぶ）
+            # 同じ場所を再度選ばないよう、候補の周囲を塗りつぶして次の候補へ
+            cx, cy = coarse_loc
+            coarse[max(0, cy - coarse_th // 2):cy + coarse_th // 2 + 1, max(0, cx - coarse_tw // 2):cx + coarse_tw // 2 + 1] = -1.0
+
+    # 文字の多い画像は縮小すると本物の位置でも一致度が大きく下がり、候補に入らないことがある
+    # 見つからない時だけ元解像度で全体を照合する（見つからないという結果は元の総当たりと同じ精度になる）
+    if not levels or max_val < confidence:
+        result = cv2.matchTemplate(full_screen, full, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+
+    if max_val < (confidence if min_confidence is None else min_confidence):
+        return max_val, None
+    return max_val, (max_loc[0] + tw // 2, max_loc[1] + th // 2)
+
+
+# 画像ごとに前回見つかった中心座標（画面配列上の座標） {画像パス: (x, y)}
+_last_match: dict[str, tuple[int, int]] = {}
+
+
+def match_near_last(screen: tuple[np.ndarray, ...], template: tuple[np.ndarray, ...], confidence: float, key: str, min_confidence: float | None = None) -> tuple[float, tuple[int, int] | None]:
+    """前回見つかった位置の周辺（テンプレート1枚分の余白）を先に照合し、なければ画面全体を探す
+
+    UIの要素はほとんど動かないので、続けて同じ画像を探す時は画面全体を照合せずに済む。
+    周辺での一致はconfidence（とLAST_MATCH_ACCEPT）以上の時だけ採用する。
+    戻り値はmatch_templateと同じ (一致度, 中心座標)
+    """
+    last = _last_match.get(key)
+    if last is not None:
+        full_screen, full = screen[0], template[0]
+        th, tw = full.shape[:2]
+        sh, sw = full_screen.shape[:2]
+        x0, y0 = max(0, last[0] - tw // 2 - tw), max(0, last[1] - th // 2 - th)
+        roi = full_screen[y0:min(sh, last[1] + th // 2 + th + 1), x0:min(sw, last[0] + tw // 2 + tw + 1)]
+        if roi.shape[0] >= th and roi.shape[1] >= tw:
+            _, val, _, loc = cv2.minMaxLoc(cv2.matchTemplate(roi, full, cv2.TM_CCOEFF_NORMED))
+            if val >= max(confidence, LAST_MATCH_ACCEPT):
+                center = (loc[0] + x0 + tw // 2, loc[1] + y0 + th // 2)
+                _last_match[key] = center
+                return val, center
+
+    score, center = match_template(screen, template, confidence, min_confidence)
+    if center is not None and score >= LAST_MATCH_ACCEPT:
+        _last_match[key] = center
+    else:
+        _last_match.pop(key, None)
+    return score, center
+
+
+def find_images_on_screen(image_names: list[str], confidence: float, min_confidence: float | None = None) -> dict[str, tuple[float, tuple[int, int] | None]]:
+    """1枚のスクリーンショットに対して複数画像を並列に照合する
+
+    戻り値: {画像名: (一致度, スクリーン上の中心座標)} - ファイルがない画像は含まない
+    座標はmin_confidence（省略時はconfidence）以上の時だけ返す
+    """
+    templates = {}
+    for image_name in image_names:
+        image_path = IMAGES_DIR / image_name
+        if image_path.exists():
+            template = load_template(image_path)
+            if template is not None:
+                templates[image_name] = template
+
+    screen, (left, top) = capture_screen()  # 画面の縮小は1回だけ行い、全テンプレートで共有する
+    if len(templates) > 1:
+        matches = MATCH_EXECUTOR.map(lambda item: match_near_last(screen, item[1], confidence, str(IMAGES_DIR / item[0]), min_confidence), templates.items())
+    else:
+        matches = [match_near_last(screen, template, confidence, str(IMAGES_DIR / name), min_confidence) for name, template in templates.items()]  # 1枚ならスレッドに渡さない
+
+    found = {}
+    for image_name, (score, center) in zip(templates, matches):
+        found[image_name] = (score, pyautogui.Point(center[0] + left, center[1] + top) if center else None)
+    return found
+
+
+def locate_on_screen(image_path: Path, confidence: float, min_confidence: float | None = None) -> tuple[float, pyautogui.Point | None]:
+    """画面を1回撮影して画像を探す（一致度, スクリーン上の中心座標）
+
+    1枚のスコアマップの最大値を返すので、精度を段階的に下げて探し直す必要はない。
+    min_confidence（省略時はconfidence）未満なら座標はNone（一致度は参考値として返す）
+    """
+    template = load_template(image_path)
+    if template is None:
+        return 0.0, None
+    screen, (left, top) = capture_screen()
+    score, center = match_near_last(screen, template, confidence, str(image_path), min_confidence)
+    if center is None:
+        return score, None
+    return score, pyautogui.Point(center[0] + left, center[1] + top)
+
+
+def execute_chain(sub_actions: list[dict], chain_interval: float | None, texts: dict, request_dict: dict, flow_name_for_paste: str = None) -> dict:
+    """複数アクションをアクション間隔なしで連続実行（貼付→送信クリックなど）"""
+    if not sub_actions:
+        return {"status": "error", "message": "[連続実行] アクションが指定されていません"}
+
+    chain_interval = chain_interval or 0.0
+    messages = []
+    for i, sub_action in enumerate(sub_actions):
+        if execution_state.abort_event.is_set():
+            return {"status": "aborted", "message": f"[連続実行] {i}/{len(sub_actions)}件目で中止されました"}
+        if i > 0 and chain_interval > 0 and execution_state.abort_event.wait(chain_interval):
+            return {"status": "aborted", "message": f"[連続実行] {i}/{len(sub_actions)}件目で中止されました"}
+
+        result = run_single_action(sub_action, texts, request_dict, flow_name_for_paste)
+        messages.append(result["message"])
+        if result["status"] != "success":
+            # 失敗したらチェーンの残りは実行しない
+            return {**result, "message": f"[連続実行] {i + 1}/{len(sub_actions)}件目で停止: {result['message']}"}
+
+    return {"status": "success", "message": f"[連続実行] {len(sub_actions)}件: " + " → ".join(messages)}
 
 
 def execute_click(image_name: str, confidence: float, min_confidence: float = 0.7, max_retries: int = 2) -> dict:
-    """画像をクリック（段階的に認識精度を下げて試行、リトライ付き）"""
-    global execution_abort_flag
+    """画像をクリック（最低精度まで許容、リトライ付き）"""
     if not image_name:
         return {"status": "error", "message": "画像が指定されていません"}
 
@@ -696,47 +1498,37 @@ def execute_click(image_name: str, confidence: float, min_confidence: float = 0.
 
     for retry in range(max_retries):
         # 中止チェック
-        if execution_abort_flag or execution_state.abort_flag:
+        if execution_state.abort_event.is_set():
             return {"status": "aborted", "message": f"[クリック] 中止されました: {image_name}"}
-        # 段階的に精度を下げて試す（浮動小数点誤差対策で0.001の余裕）
-        current_conf = confidence
-        while current_conf >= min_confidence - 0.001:
-            # 中止チェック
-            if execution_abort_flag or execution_state.abort_flag:
-                return {"status": "aborted", "message": f"[クリック] 中止されました: {image_name}"}
-            try:
-                location = pyautogui.locateCenterOnScreen(str(image_path), confidence=current_conf)
-                if location is not None:
-                    pyautogui.click(location)
-                    retry_note = f", リトライ{retry+1}回目" if retry > 0 else ""
-                    if current_conf < confidence - 0.001:
-                        return {"status": "success", "message": f"[クリック] {image_name} (位置: {location}, 精度{int(round(current_conf*100))}%で検出{retry_note})"}
-                    else:
-                        return {"status": "success", "message": f"[クリック] {image_name} (位置: {location}{retry_note})"}
-            except pyautogui.ImageNotFoundException:
-                pass
-            except Exception:
-                pass
-            current_conf -= 0.02
+        # 1回照合し、スコアから何%で検出できたかを判定する（浮動小数点誤差対策で0.001の余裕）
+        # 診断用の下限で照合しておけば、失敗時にそのスコアをそのまま報告できる
+        try:
+            score, location = locate_on_screen(image_path, confidence, DIAGNOSTIC_MIN_CONFIDENCE)
+        except Exception:
+            score, location = 0.0, None
+        if location is not None and score >= min_confidence - 0.001:
+            pyautogui.click(location)
+            retry_note = f", リトライ{retry+1}回目" if retry > 0 else ""
+            if score < confidence - 0.001:
+                return {"status": "success", "message": f"[クリック] {image_name} (位置: {location}, 精度{int(score*100)}%で検出{retry_note})"}
+            else:
+                return {"status": "success", "message": f"[クリック] {image_name} (位置: {location}{retry_note})"}
 
         # 見つからなかった場合、次のリトライ前に1秒待機
         if retry < max_retries - 1:
-            time.sleep(1.0)
+            execution_state.abort_event.wait(1.0)  # 中止されたら次の中止チェックで抜ける
 
-    # 最低精度でも見つからなかった場合、どの程度で検出可能か調べる
-    found_conf, _ = find_best_match_confidence(str(image_path), min_confidence)
-
-    if found_conf is not None:
-        return {"status": "not_found", "message": f"画面上に画像が見つかりません: {image_name} ({max_retries}回試行後も失敗、最大{int(found_conf*100)}%で検出、最低設定は{int(min_confidence*100)}%)"}
+    # 最低精度でも見つからなかった場合、最後の照合でどの程度似ていたかを報告（撮り直さない）
+    if location is not None:
+        return {"status": "not_found", "message": f"画面上に画像が見つかりません: {image_name} ({max_retries}回試行後も失敗、最大{int(score*100)}%で検出、最低設定は{int(min_confidence*100)}%)"}
 
     return {"status": "not_found", "message": f"画面上に画像が見つかりません: {image_name} ({max_retries}回試行後も失敗、30%未満)"}
 
 
 def execute_click_if_exists(image_name: str, confidence: float, min_confidence: float = 0.7) -> dict:
     """画像が存在すればクリック、なければスキップ（エラーにしない）"""
-    global execution_abort_flag
     # 中止チェック
-    if execution_abort_flag or execution_state.abort_flag:
+    if execution_state.abort_event.is_set():
         return {"status": "aborted", "message": f"[条件クリック] 中止されました: {image_name}"}
     if not image_name:
         return {"status": "skipped", "message": "[スキップ] 画像が指定されていません"}
@@ -745,82 +1537,63 @@ def execute_click_if_exists(image_name: str, confidence: float, min_confidence:
     if not image_path.exists():
         return {"status": "skipped", "message": f"[スキップ] 画像ファイルが見つかりません: {image_name}"}
 
-    # 段階的に精度を下げて試す
-    current_conf = confidence
-    while current_conf >= min_confidence - 0.001:
-        # 中止チェック
-        if execution_abort_flag or execution_state.abort_flag:
-            return {"status": "aborted", "message": f"[条件クリック] 中止されました: {image_name}"}
-        try:
-            location = pyautogui.locateCenterOnScreen(str(image_path), confidence=current_conf)
-            if location is not None:
-                pyautogui.click(location)
-                if current_conf < confidence - 0.001:
-                    return {"status": "success", "message": f"[条件クリック] {image_name} (位置: {location}, 精度{int(round(current_conf*100))}%で検出)"}
-                else:
-                    return {"status": "success", "message": f"[条件クリック] {image_name} (位置: {location})"}
-        except pyautogui.ImageNotFoundException:
-            pass
-        except Exception:
-            pass
-        current_conf -= 0.02
+    # 最低精度で1回照合し、スコアから何%で検出できたかを判定する
+    try:
+        score, location = locate_on_screen(image_path, confidence, min_confidence - 0.001)
+    except Exception:
+        score, location = 0.0, None
+    if location is not None:
+        pyautogui.click(location)
+        if score < confidence - 0.001:
+            return {"status": "success", "message": f"[条件クリック] {image_name} (位置: {location}, 精度{int(score*100)}%で検出)"}
+        else:
+            return {"status": "success", "message": f"[条件クリック] {image_name} (位置: {location})"}
 
     # 見つからなかった場合はスキップ（エラーではない）
     return {"status": "skipped", "message": f"[スキップ] 画像が見つからないためスキップ: {image_name}"}
 
 
 def execute_click_or(image_names: list[str], confidence: float, min_confidence: float = 0.7, max_retries: int = 2) -> dict:
-    """複数画像のうち最初に見つかった画像をクリック（段階的に精度を下げて試行、リトライ付き）"""
-    global execution_abort_flag
+    """複数画像のうち最も一致度の高い画像をクリック（最低精度まで許容、リトライ付き）"""
     if not image_names or len(image_names) == 0:
         return {"status": "error", "message": "画像が指定されていません"}
 
     for retry in range(max_retries):
         # 中止チェック
-        if execution_abort_flag or execution_state.abort_flag:
+        if execution_state.abort_event.is_set():
             return {"status": "aborted", "message": "[クリックOR] 中止されました"}
-        # 各精度レベルで全画像を試す
-        current_conf = confidence
-        while current_conf >= min_confidence - 0.001:
-            # 中止チェック
-            if execution_abort_flag or execution_state.abort_flag:
-                return {"status": "aborted", "message": "[クリックOR] 中止されました"}
-            for image_name in image_names:
-                image_path = IMAGES_DIR / image_name
-                if not image_path.exists():
-                    continue
-
-                try:
-                    location = pyautogui.locateCenterOnScreen(str(image_path), confidence=current_conf)
-                    if location is not None:
-                        pyautogui.click(location)
-                        retry_note = f", リトライ{retry+1}回目" if retry > 0 else ""
-                        if current_conf < confidence - 0.001:
-                            return {"status": "success", "message": f"[クリックOR] {image_name} (位置: {location}, 精度{int(current_conf*100)}%で検出{retry_note})"}
-                        else:
-                            return {"status": "success", "message": f"[クリックOR] {image_name} (位置: {location}{retry_note})"}
-                except pyautogui.ImageNotFoundException:
-                    pass
-                except Exception:
-                    pass
-
-            current_conf -= 0.02
+        # 1回の撮影で全画像の一致度をまとめて求める（画像ごとに撮り直さない）
+        # 診断用の下限で照合しておき、失敗時の報告にも同じ結果を使う
+        found = find_images_on_screen(image_names, confidence, DIAGNOSTIC_MIN_CONFIDENCE)
+
+        # 最も一致度の高い画像をクリック（同点ならリストの先頭を優先）
+        candidates = [
+            (score, location, image_name) for image_name, (score, location) in found.items()
+            if location is not None and score >= min_confidence - 0.001
+        ]
+        if candidates:
+            score, location, image_name = max(candidates, key=lambda c: c[0])
+            pyautogui.click(location)
+            retry_note = f", リトライ{retry+1}回目" if retry > 0 else ""
+            if score < confidence - 0.001:
+                return {"status": "success", "message": f"[クリックOR] {image_name} (位置: {location}, 精度{int(score*100)}%で検出{retry_note})"}
+            else:
+                return {"status": "success", "message": f"[クリックOR] {image_name} (位置: {location}{retry_note})"}
 
         # 見つからなかった場合、次のリトライ前に1秒待機
         if retry < max_retries - 1:
-            time.sleep(1.0)
+            execution_state.abort_event.wait(1.0)  # 中止されたら次の中止チェックで抜ける
 
-    # どの画像も見つからなかった場合、検出可能な精度を調べる
+    # どの画像も見つからなかった場合、最後の照合での一致度を報告（撮り直さない）
     not_found_details = []
     for image_name in image_names:
-        image_path = IMAGES_DIR / image_name
-        if not image_path.exists():
+        if image_name not in found:
             not_found_details.append(f"{image_name}(ファイルなし)")
             continue
 
-        found_conf, _ = find_best_match_confidence(str(image_path), min_confidence)
-        if found_conf is not None:
-            not_found_details.append(f"{image_name}({int(found_conf*100)}%)")
+        score, location = found[image_name]
+        if location is not None:
+            not_found_details.append(f"{image_name}({int(score*100)}%)")
         else:
             not_found_details.append(f"{image_name}(30%未満)")
 
@@ -863,12 +1636,54 @@ def execute_paste_fixed(text: str, flow_name: str = None) -> dict:
     return {"status": "success", "message": f"[固定貼付] {display_text}"}
 
 
-def smooth_move_cursor(target_x: int, target_y: int, duration: float = 0.5):
-    """カーソルをスムーズに移動"""
-    # PyAutoGUIのmoveToにdurationとtweenを指定
-    # MINIMUM_DURATION(0.1秒)以上必要
-    actual_duration = max(duration, 0.2)
-    pyautogui.moveTo(target_x, target_y, duration=actual_duration, tween=pyautogui.easeInOutQuad)
+class CursorWiggler:
+    """待機中を示すためにカーソルを左右に動かし続ける（画像照合とは別スレッド）
+
+    照合ループがカーソル移動（0.2秒以上）の完了を待たずに済むよう、揺らしは独自の周期で行う。
+    with で使い、抜けると（またはstop()で）止まる。
+    """
+
+    def __init__(self, cursor_speed: float = 0.5, amount: int = 100):
+        # PyAutoGUIのMINIMUM_DURATION(0.1秒)以上必要
+        self.duration = max(cursor_speed, 0.2)
+        self.amount = amount  # 移動量（ピクセル）- 見やすく
+        self.stop_event = threading.Event()
+        self.error = None  # 揺らし中に作動したフェイルセーフ（照合ループ側でcheck()して投げ直す）
+        self.thread = threading.Thread(target=self.run, name="cursor-wiggle", daemon=True)
+
+    def run(self):
+        direction = 1  # カーソル移動方向（1: 右, -1: 左）
+        while not self.stop_event.is_set():
+            try:
+                # 現在位置を問い合わせず相対移動する
+                pyautogui.moveRel(self.amount * direction, 0, duration=self.duration, tween=pyautogui.easeInOutQuad)
+            except pyautogui.FailSafeException as e:
+                # このスレッドで投げても待機は止まらないので、照合ループに渡す
+                self.error = e
+                return
+            except Exception as e:
+                print(f"[WARN] カーソル移動失敗: {e}")
+                return
+            direction *= -1  # 方向を反転
+            self.stop_event.wait(CURSOR_WIGGLE_INTERVAL)
+
+    def check(self):
+        """揺らし中にフェイルセーフ（画面左上へのマウス移動）が作動していれば、呼び出し元で投げ直す"""
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """揺らしを止め、移動中の分が終わるまで待つ"""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
 
 
 def execute_wait(image_name: str, confidence: float, timeout: float, cursor_speed: float = 0.5) -> dict:
@@ -880,38 +1695,55 @@ def execute_wait(image_name: str, confidence: float, timeout: float, cursor_spee
     if not image_path.exists():
         return {"status": "error", "message": f"画像ファイルが見つかりません: {image_name}"}
 
-    start_time = time.time()
-    move_direction = 1  # カーソル移動方向（1: 右, -1: 左）
-    move_amount = 100  # 移動量（ピクセル）- 見やすく
-
-    while time.time() - start_time < timeout:
-        # 中止チェック（両方のフラグをチェック）
-        if execution_abort_flag or execution_state.abort_flag:
-            return {"status": "aborted", "message": f"[待機] 中止されました: {image_name}"}
-
-        try:
-            location = pyautogui.locateCenterOnScreen(str(image_path), confidence=confidence)
-        except pyautogui.ImageNotFoundException:
-            location = None
-        except Exception:
-            location = None
+    template = load_template(image_path)
+    if template is None:
+        return {"status": "error", "message": f"画像ファイルを読み込めません: {image_name}"}
 
-        if location is not None:
-            # 検出した画像の100ピクセル上にカーソルを移動（スクロールエリアをクリックしやすくする）
-            target_y = max(0, location.y - 100)
-            pyautogui.moveTo(location.x, target_y, duration=0.2)
-            return {"status": "success", "message": f"[待機] 画像を検出: {image_name} (位置: {location}, カーソル移動先: y={target_y})"}
+    deadline = time.monotonic() + timeout  # 時計合わせの影響を受けない単調時計で計測
+    poll_delay = WAIT_POLL_INITIAL  # 画像チェックの間隔（見つからない間は徐々に延ばす）
+    screen = None  # 最後に照合した画面（タイムアウト時の診断に使い、撮り直さない）
+    last_gray = None  # 最後に照合した画面（縮小前）- 変化がなければ照合を省く
+    levels = coarse_level(template) + 1
 
-        # 待機中を示すためにカーソルを左右にスムーズに動かす
-        current_pos = pyautogui.position()
-        target_x = current_pos[0] + (move_amount * move_direction)
-        smooth_move_cursor(target_x, current_pos[1], cursor_speed)
-        move_direction *= -1  # 方向を反転
+    # スクリーンショットはmssで取得し、OpenCVで直接照合する（PIL変換を挟まない）
+    # 待機中のカーソルの揺らしは別スレッドに任せ、照合の間隔に影響させない
+    with mss.mss() as sct, CursorWiggler(cursor_speed) as wiggler:
+        while time.monotonic() < deadline:
+            # 中止チェック
+            if execution_state.abort_event.is_set():
+                return {"status": "aborted", "message": f"[待機] 中止されました: {image_name}"}
+            wiggler.check()
 
-        time.sleep(0.1)  # 画像チェックの間隔
+            try:
+                gray, (left, top) = grab_screen_gray(sct)
+                if last_gray is not None and np.array_equal(gray, last_gray):
+                    location = None  # 前回見つからなかった画面から何も変わっていない
+                else:
+                    last_gray = gray
+                    screen = build_pyramid(gray, levels)  # このテンプレートで使う段までだけ縮小する
+                    _, center = match_near_last(screen, template, confidence, str(image_path))
+                    location = pyautogui.Point(center[0] + left, center[1] + top) if center else None
+            except Exception:
+                location = None
 
-    # タイムアウト時に信頼度を調べる
-    found_conf, _ = find_best_match_confidence(str(image_path), confidence)
+            if location is not None:
+                wiggler.stop()  # 揺らしと移動が重ならないよう先に止める
+                # 検出した画像の100ピクセル上にカーソルを移動（スクロールエリアをクリックしやすくする）
+                target_y = max(0, location.y - 100)
+                pyautogui.moveTo(location.x, target_y, duration=0.2)
+                return {"status": "success", "message": f"[待機] 画像を検出: {image_name} (位置: {location}, カーソル移動先: y={target_y})"}
+
+            # すぐ出る画像は早く検出し、長い待機では照合回数を抑える（0.1秒から1.25倍ずつ、最大1秒）
+            if execution_state.abort_event.wait(max(0.0, min(poll_delay, deadline - time.monotonic()))):
+                return {"status": "aborted", "message": f"[待機] 中止されました: {image_name}"}
+            poll_delay = min(poll_delay * WAIT_POLL_BACKOFF, WAIT_APPEAR_POLL_MAX)
+
+    # タイムアウト時は最後に照合した画面で、どの程度似ていたかを調べる
+    found_conf = None
+    if screen is not None:
+        score, center = match_template(screen, template, confidence, DIAGNOSTIC_MIN_CONFIDENCE)
+        if center is not None:
+            found_conf = score
     if found_conf is not None:
         return {"status": "timeout", "message": f"タイムアウト: {image_name} が {timeout}秒以内に見つかりませんでした (最大{int(found_conf*100)}%、設定は{int(confidence*100)}%)"}
     return {"status": "timeout", "message": f"タイムアウト: {image_name} が {timeout}秒以内に見つかりませんでした (30%未満、画像が画面にない可能性)"}
@@ -931,7 +1763,7 @@ def execute_wait_disappear(image_name: str, confidence: float, timeout: float, c
 
     # まず画像が存在することを確認
     try:
-        location = pyautogui.locateCenterOnScreen(str(image_path), confidence=confidence)
+        _, location = locate_on_screen(image_path, confidence)
     except Exception as e:
         print(f"[DEBUG] 消失待機 初回チェック例外: {type(e).__name__}: {e}")
         location = None
@@ -939,65 +1771,59 @@ def execute_wait_disappear(image_name: str, confidence: float, timeout: float, c
     if location is None:
         return {"status": "success", "message": f"[消失待機] 画像は既に画面にありません: {image_name}"}
 
-    start_time = time.time()
-    move_direction = 1
-    move_amount = 100
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    poll_delay = WAIT_POLL_INITIAL  # 画像がまだある間は徐々に間隔を延ばす
     consecutive_not_found = 0  # 連続して見つからなかった回数
     required_consecutive = 3   # 成功判定に必要な連続回数
     check_count = 0            # 総チェック回数（ログ用）
 
-    while time.time() - start_time < timeout:
-        # 中止チェック（両方のフラグをチェック）
-        if execution_abort_flag or execution_state.abort_flag:
-            return {"status": "aborted", "message": f"[消失待機] 中止されました: {image_name}"}
+    # 待機中のカーソルの揺らしは別スレッドに任せ、照合の間隔に影響させない
+    with CursorWiggler(cursor_speed) as wiggler:
+        while time.monotonic() < deadline:
+            # 中止チェック
+            if execution_state.abort_event.is_set():
+                return {"status": "aborted", "message": f"[消失待機] 中止されました: {image_name}"}
+            wiggler.check()
 
-        check_count += 1
+            check_count += 1
 
-        # 指定された信頼度で検索
-        try:
-            location = pyautogui.locateCenterOnScreen(str(image_path), confidence=confidence)
-        except pyautogui.ImageNotFoundException:
-            location = None
-        except Exception:
-            location = None
+            # 診断用の下限で1回照合し、指定信頼度に届いたかと実際の一致度を同時に得る
+            try:
+                score, candidate = locate_on_screen(image_path, confidence, DIAGNOSTIC_MIN_CONFIDENCE)
+            except Exception:
+                score, candidate = 0.0, None
+            location = candidate if score >= confidence else None
 
-        # 見つからなかった場合、低い信頼度で再チェックして実際の検出状況を確認
-        actual_conf = None
-        if location is None:
-            for test_conf in [0.3, 0.5, 0.7, 0.8, 0.9]:
-                try:
-                    test_loc = pyautogui.locateCenterOnScreen(str(image_path), confidence=test_conf)
-                    if test_loc:
-                        actual_conf = test_conf
-                        break
-                except:
-                    pass
-
-        if location is None:
-            consecutive_not_found += 1
-            if actual_conf:
-                print(f"[DEBUG] 消失待機 チェック#{check_count}: 閾値{int(confidence*100)}%で不検出、実際は{int(actual_conf*100)}%で存在 ({consecutive_not_found}/{required_consecutive}回連続)")
+            # 見つからなかった場合も、低い信頼度での実際の検出状況を残す
+            actual_conf = score if location is None and candidate is not None else None
+
+            if location is None:
+                consecutive_not_found += 1
+                if actual_conf:
+                    print(f"[DEBUG] 消失待機 チェック#{check_count}: 閾値{int(confidence*100)}%で不検出、実際は{int(actual_conf*100)}%で存在 ({consecutive_not_found}/{required_consecutive}回連続)")
+                else:
+                    print(f"[DEBUG] 消失待機 チェック#{check_count}: 完全に見つからず（30%未満） ({consecutive_not_found}/{required_consecutive}回連続)")
+
+                # 50%以上で見つかる場合は「まだ存在している」のでリセット
+                if actual_conf and actual_conf >= 0.5:
+                    print(f"[DEBUG] → 50%以上で検出されるため、連続カウントをリセット")
+                    consecutive_not_found = 0
+                elif consecutive_not_found >= required_consecutive:
+                    elapsed = time.monotonic() - start_time
+                    return {"status": "success", "message": f"[消失待機] 画像が消えました: {image_name} ({elapsed:.1f}秒後、{check_count}回チェック、{required_consecutive}回連続不検出で確定)"}
             else:
-                print(f"[DEBUG] 消失待機 チェック#{check_count}: 完全に見つからず（30%未満） ({consecutive_not_found}/{required_consecutive}回連続)")
-
-            # 50%以上で見つかる場合は「まだ存在している」のでリセット
-            if actual_conf and actual_conf >= 0.5:
-                print(f"[DEBUG] → 50%以上で検出されるため、連続カウントをリセット")
-                consecutive_not_found = 0
-            elif consecutive_not_found >= required_consecutive:
-                elapsed = time.time() - start_time
-                return {"status": "success", "message": f"[消失待機] 画像が消えました: {image_name} ({elapsed:.1f}秒後、{check_count}回チェック、{required_consecutive}回連続不検出で確定)"}
-        else:
-            if consecutive_not_found > 0:
-                print(f"[DEBUG] 消失待機 チェック#{check_count}: 検出 (連続不検出{consecutive_not_found}回→リセット)")
-            consecutive_not_found = 0  # 見つかったらリセット
-        # 待機中を示すためにカーソルを左右にスムーズに動かす
-        current_pos = pyautogui.position()
-        target_x = current_pos[0] + (move_amount * move_direction)
-        smooth_move_cursor(target_x, current_pos[1], cursor_speed)
-        move_direction *= -1
+                if consecutive_not_found > 0:
+                    print(f"[DEBUG] 消失待機 チェック#{check_count}: 検出 (連続不検出{consecutive_not_found}回→リセット)")
+                consecutive_not_found = 0  # 見つかったらリセット
 
-        time.sleep(0.5)  # 画像チェックの間隔（消失待機は少し長めに）
+            # 消え始めたら（連続不検出の確認中は）すぐ確認し、画像が残っている間は間隔を延ばす
+            if consecutive_not_found > 0:
+                poll_delay = WAIT_POLL_INITIAL
+            else:
+                poll_delay = min(poll_delay * WAIT_POLL_BACKOFF, WAIT_POLL_MAX)
+            if execution_state.abort_event.wait(max(0.0, min(poll_delay, deadline - time.monotonic()))):
+                return {"status": "aborted", "message": f"[消失待機] 中止されました: {image_name}"}
 
     return {"status": "timeout", "message": f"タイムアウト: {image_name} が {timeout}秒以内に消えませんでした ({check_count}回チェック)"}
 
@@ -1005,18 +1831,14 @@ def execute_wait_disappear(image_name: str, confidence: float, timeout: float, c
 
 def execute_wait_seconds(seconds: float) -> dict:
     """指定秒数だけ待機（秒数待機）"""
-    global execution_abort_flag
     if seconds is None or seconds < 0:
         return {"status": "error", "message": "秒数が指定されていません"}
 
-    # 1秒刻みで中止チェック
-    elapsed = 0
-    while elapsed < seconds:
-        if execution_abort_flag or execution_state.abort_flag:
-            return {"status": "aborted", "message": f"[秒数待機] {elapsed}/{seconds}秒で中止されました"}
-        sleep_time = min(1.0, seconds - elapsed)
-        time.sleep(sleep_time)
-        elapsed += sleep_time
+    # 中止されたらすぐ抜ける
+    start_time = time.monotonic()
+    if execution_state.abort_event.wait(seconds):
+        elapsed = round(time.monotonic() - start_time, 1)
+        return {"status": "aborted", "message": f"[秒数待機] {elapsed}/{seconds}秒で中止されました"}
     return {"status": "success", "message": f"[秒数待機] {seconds}秒待機しました"}
 
 
@@ -1038,82 +1860,181 @@ def execute_pagedown(count: int) -> dict:
     return {"status": "success", "message": f"[PageDown] {count}回押しました (クリック位置: {click_pos})"}
 
 
+# 追記用に開いたままにしておくファイル記述子（LRU、古いものから閉じる）
+APPEND_FD_CACHE_SIZE = 16
+_append_fds: OrderedDict[str, int] = OrderedDict()
+append_fds_lock = threading.Lock()
+
+
+def write_all(fd: int, data: bytes):
+    """os.writeが途中までしか書かなかった場合も残りを書き切る"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def is_same_file(fd: int, path: str) -> bool:
+    """開いている記述子が、今そのパスにあるファイルを指しているか（移動・削除・置き換えの検出）"""
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(fd)
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+
+def append_to_file(path: Path, content: str | bytes, keep_open: bool = False):
+    """ファイル末尾に追記
+
+    keep_open=Trueはサーバーが管理するファイル（テキストの追記ログ・バッチログ）用で、
+    記述子を使い回して毎回のopen/closeを省く。ファイルが移動・削除されていたら開き直す。
+    ユーザーが扱う保存ファイルは開いたままにしない（Windowsでは開いている間は削除・移動できない）
+
+    strはテキストモードのopenと同じく改行をOSの改行（WindowsではCRLF）に変換して書く。
+    bytesはそのまま書く（テキストの追記ログはサーバーだけが読むのでLFのまま）
+    """
+    if isinstance(content, str):
+        if os.linesep != "\n":
+            content = content.replace("\n", os.linesep)
+        data = content.encode("utf-8")
+    else:
+        data = content
+    key = str(path)
+    if not keep_open:
+        fd = os.open(key, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            write_all(fd, data)
+        finally:
+            os.close(fd)
+        return
+
+    with append_fds_lock:
+        fd = _append_fds.pop(key, None)
+        if fd is not None and not is_same_file(fd, key):
+            os.close(fd)  # 古いファイルに書き続けないよう開き直す
+            fd = None
+        if fd is None:
+            fd = os.open(key, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if len(_append_fds) >= APPEND_FD_CACHE_SIZE:
+                _, oldest_fd = _append_fds.popitem(last=False)
+                os.close(oldest_fd)
+        _append_fds[key] = fd
+        write_all(fd, data)
+
+
+@atexit.register
+def close_append_fds():
+    """開いたままの追記用ファイル記述子を閉じる"""
+    with append_fds_lock:
+        while _append_fds:
+            _, fd = _append_fds.popitem()
+            os.close(fd)
+
+
+# ファイル名・保存ファイル解析用の正規表現（呼び出しごとにコンパイルしない）
+INVALID_FILENAME_CHARS_RE = re.compile(r'[\\/:*?"<>|\r\n\t]')
+WHITESPACE_RE = re.compile(r'\s+')
+FLOW_NAME_RE = re.compile(r"フロー:\s*(.+)")
+SECTION_SEPARATOR = "#" * 50  # 保存ファイルのセクション区切り
+CHAR_STATS_GROUPS = frozenset({'ai-normal', 'ai-dr'})  # 保存時に文字数ログを追記するグループ
+
+
 def sanitize_filename(text: str, max_length: int = 30) -> str:
     """ファイル名に使えない文字を除去し、長さを制限"""
-    import re
     # ファイル名に使えない文字を除去
-    sanitized = re.sub(r'[\\/:*?"<>|\r\n\t]', '', text)
+    sanitized = INVALID_FILENAME_CHARS_RE.sub('', text)
     # 空白を_に置換
-    sanitized = re.sub(r'\s+', '_', sanitized)
+    sanitized = WHITESPACE_RE.sub('_', sanitized)
     # 長さ制限
     if len(sanitized) > max_length:
         sanitized = sanitized[:max_length]
     return sanitized or "untitled"
 
-def analyze_file_character_counts(filepath: Path) -> dict:
-    """ファイル内の各AIセクションの文字数をカウント"""
-    import re
+# 保存ファイルごとの文字数集計キャッシュ {パス: ((サイズ, mtime_ns), セクション一覧)}
+_char_count_cache: dict[str, tuple[tuple[int, int], list[dict]]] = {}
 
-    if not filepath.exists():
-        return {"total": 0, "sections": []}
 
+def file_signature(filepath: Path) -> tuple[int, int] | None:
+    """ファイルの (サイズ, mtime_ns)。なければNone"""
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            file_content = f.read()
-    except Exception:
-        return {"total": 0, "sections": []}
+        stat = filepath.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
 
-    # セパレータで分割
-    # ファイル形式:
-    # ##################################################
-    # フロー: name
-    # 日時: timestamp
-    # ##################################################
-    # [body content]
-    separator = "#" * 50
-    sections = file_content.split(separator)
+
+def count_sections(content: str) -> list[dict]:
+    """保存形式のテキストから各AIセクションのフロー名・文字数・行数を数える
+
+    ファイル形式:
+    ##################################################
+    フロー: name
+    日時: timestamp
+    ##################################################
+    [body content]
+    """
+    sections = content.split(SECTION_SEPARATOR)
 
     results = []
-    i = 0
-    while i < len(sections):
-        section = sections[i]
-        if "フロー:" in section:
-            # フロー名を抽出
-            match = re.search(r"フロー:\s*(.+)", section)
-            if match:
-                flow_name = match.group(1).strip()
-                # 次のセクションが本文
-                body_text = ""
-                if i + 1 < len(sections):
-                    body_text = sections[i + 1].strip()
-                char_count = len(body_text)
-                line_count = len([l for l in body_text.split("\n") if l.strip()])
-                results.append({
-                    "flow_name": flow_name,
-                    "chars": char_count,
-                    "lines": line_count
-                })
-        i += 1
+    for i, section in enumerate(sections):
+        if "フロー:" not in section:
+            continue
+        # フロー名を抽出
+        match = FLOW_NAME_RE.search(section)
+        if not match:
+            continue
+        # 次のセクションが本文
+        body_text = sections[i + 1].strip() if i + 1 < len(sections) else ""
+        results.append({
+            "flow_name": match.group(1).strip(),
+            "chars": len(body_text),
+            "lines": len([l for l in body_text.split("\n") if l.strip()])
+        })
+    return results
+
+
+def analyze_file_character_counts(filepath: Path, appended: tuple[tuple[int, int] | None, str] | None = None) -> dict:
+    """ファイル内の各AIセクションの文字数をカウント
+
+    appended: 直前の追記の (追記前のfile_signature, 追記した内容)。
+    追記前の集計がキャッシュにあれば、追記分だけを数えて足す（ファイル全体を読み直さない）
+    """
+    signature = file_signature(filepath)
+    if signature is None:
+        return {"total": 0, "sections": []}
+
+    key = str(filepath)
+    cached = _char_count_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        results = cached[1]
+    elif cached is not None and appended is not None and cached[0] == appended[0]:
+        # 追記は前のセクションの本文を変えないので、追記分のセクションを足すだけでよい
+        results = cached[1] + count_sections(appended[1])
+    else:
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                results = count_sections(f.read())
+        except Exception:
+            return {"total": 0, "sections": []}
+    _char_count_cache[key] = (signature, results)
 
     total_chars = sum(r["chars"] for r in results)
-    return {"total": total_chars, "sections": results}
+    return {"total": total_chars, "sections": list(results)}
+
+
 
+# グループ名の日本語ラベル（保存ファイル名に使う）
+GROUP_LABELS = {
+    'ai-normal': 'AI-通常',
+    'ai-dr': 'AI-DR',
+    'ai-chat': 'AI会話',
+    'blog': 'ブログ投稿',
+    'image-gen': '画像生成'
+}
 
 
 def execute_save_to_file(text_id: str, flow_name: str, group_name: str, texts: dict) -> dict:
     """クリップボードの内容をファイルに追記保存"""
-    from datetime import datetime
-    import re
-
-    # グループ名の日本語ラベル
-    GROUP_LABELS = {
-        'ai-normal': 'AI-通常',
-        'ai-dr': 'AI-DR',
-        'ai-chat': 'AI会話',
-        'blog': 'ブログ投稿',
-        'image-gen': '画像生成'
-    }
-
     # テキストIDからファイル名を決定
     if text_id and text_id in texts:
         text_content = texts[text_id]["text"]
@@ -1126,8 +2047,9 @@ def execute_save_to_file(text_id: str, flow_name: str, group_name: str, texts: d
     group_label = GROUP_LABELS.get(group_name, '未分類') if group_name else '未分類'
     filename_base = f"{group_label}_{text_part}"
 
-    # 日付フォルダを作成
-    today = datetime.now().strftime("%Y-%m-%d")
+    # 日付フォルダを作成（日付とタイムスタンプは同じ時刻から作る）
+    now = datetime.now()
+    today = now.strftime("%Y-%m-%d")
     output_dir = Path(__file__).parent / "output" / today
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -1149,26 +2071,25 @@ def execute_save_to_file(text_id: str, flow_name: str, group_name: str, texts: d
         return {"status": "error", "message": f"[ファイル保存] クリップボードの内容がプロンプトと同じです。回答をコピーし忘れていませんか？"}
 
     # 保存内容を作成
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    separator = "#" * 50
-    save_content = f"\n{separator}\nフロー: {flow_name or '(名前なし)'}\n日時: {timestamp}\n{separator}\n{clipboard_content}\n"
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    save_content = f"\n{SECTION_SEPARATOR}\nフロー: {flow_name or '(名前なし)'}\n日時: {timestamp}\n{SECTION_SEPARATOR}\n{clipboard_content}\n"
 
     # 今回保存する内容の文字数をカウント（clipboard_contentの文字数）
     content_char_count = len(clipboard_content.strip())
 
-    # ファイルに追記
+    # AI-通常、AI-DRの場合は文字数ログも一緒に追記
+    if group_name in CHAR_STATS_GROUPS:
+        save_content += f"\n---\n📊 {timestamp} | {flow_name}: {content_char_count}文字\n"
+
+    # ファイルに追記（1回の書き込みで済ませる）
     try:
-        with open(filepath, "a", encoding="utf-8") as f:
-            f.write(save_content)
-            # AI-通常、AI-DRの場合は文字数ログも追記
-            if group_name in ['ai-normal', 'ai-dr']:
-                char_log = f"\n---\n📊 {timestamp} | {flow_name}: {content_char_count}文字\n"
-                f.write(char_log)
+        signature_before = file_signature(filepath)
+        append_to_file(filepath, save_content)
 
         # 文字数カウントを取得（AI-通常、AI-DRの場合）
         char_stats = None
-        if group_name in ['ai-normal', 'ai-dr']:
-            char_stats = analyze_file_character_counts(filepath)
+        if group_name in CHAR_STATS_GROUPS:
+            char_stats = analyze_file_character_counts(filepath, (signature_before, save_content))
 
         result = {"status": "success", "message": f"[ファイル保存] {filepath.name} に追記しました ({content_char_count}文字)"}
         if char_stats:
@@ -1178,9 +2099,8 @@ def execute_save_to_file(text_id: str, flow_name: str, group_name: str, texts: d
         return {"status": "error", "message": f"ファイル保存エラー: {e}"}
 
 
-def execute_loop_click(image_name: str, confidence: float, min_confidence: float, loop_count: int, loop_interval: int, execution_state) -> dict:
+def execute_loop_click(image_name: str, confidence: float, min_confidence: float, loop_count: int, loop_interval: float, execution_state) -> dict:
     """画像を指定回数、指定間隔でループクリック"""
-    global execution_abort_flag
 
     if not image_name:
         return {"status": "error", "message": "画像が指定されていません"}
@@ -1189,90 +2109,114 @@ def execute_loop_click(image_name: str, confidence: float, min_confidence: float
     if not image_path.exists():
         return {"status": "error", "message": f"画像ファイルが見つかりません: {image_name}"}
 
+    # テンプレートはループの前に1回だけ読み込む
+    template = load_template(image_path)
+    if template is None:
+        return {"status": "error", "message": f"画像ファイルを読み込めません: {image_name}"}
+
     success_count = 0
     fail_count = 0
+    levels = coarse_level(template) + 1  # 画面はこのテンプレートで使う段までだけ縮小する
 
-    for i in range(loop_count):
-        # 中止チェック
-        if execution_state.abort_flag or execution_abort_flag:
-            return {"status": "aborted", "message": f"[ループクリック] {i}/{loop_count}回で中止 (成功: {success_count}, 失敗: {fail_count})"}
+    # スクリーンショット取得用のmssはループ全体で使い回す
+    with mss.mss() as sct:
+        for i in range(loop_count):
+            # 中止チェック
+            if execution_state.abort_event.is_set():
+                return {"status": "aborted", "message": f"[ループクリック] {i}/{loop_count}回で中止 (成功: {success_count}, 失敗: {fail_count})"}
 
-        # クリック試行
-        clicked = False
-        current_conf = confidence
-        while current_conf >= min_confidence - 0.001:
+            # クリック試行
             try:
-                location = pyautogui.locateCenterOnScreen(str(image_path), confidence=current_conf)
-                if location is not None:
-                    pyautogui.click(location)
-                    clicked = True
-                    success_count += 1
-                    break
-            except:
-                pass
-            current_conf -= 0.02
-
-        if not clicked:
-            fail_count += 1
-
-        # 進捗を報告（10回ごと、または最初と最後）
-        if i == 0 or (i + 1) % 10 == 0 or i == loop_count - 1:
-            execution_state.add_result({
-                "status": "info",
-                "message": f"[ループクリック] {i + 1}/{loop_count}回完了 (成功: {success_count}, 失敗: {fail_count})"
-            })
-
-        # 最後のループ以外は間隔待機 - 1秒刻みで中止チェック
-        if i < loop_count - 1:
-            elapsed = 0
-            while elapsed < loop_interval:
-                if execution_abort_flag or execution_state.abort_flag:
-                    return {"status": "aborted", "message": f"[ループクリック] {i+1}/{loop_count}回で中止 (成功: {success_count}, 失敗: {fail_count})"}
-                sleep_time = min(1.0, loop_interval - elapsed)
-                time.sleep(sleep_time)
-                elapsed += sleep_time
+                screen, (left, top) = grab_screen_gray(sct)
+                _, center = match_near_last(build_pyramid(screen, levels), template, confidence, str(image_path), min_confidence - 0.001)
+            except Exception:
+                center = None
+            if center is not None:
+                # 次のクリックまではloop_intervalで待つので、pyautoguiの操作後待ち（PAUSE）は省く
+                pyautogui.click(pyautogui.Point(center[0] + left, center[1] + top), _pause=False)
+                success_count += 1
+            else:
+                fail_count += 1
+
+            # 途中経過を報告（10回ごと、または最初と最後）
+            # 結果一覧に積むとステップ数とアクションの対応がずれるので、実行中の表示だけを更新する
+            if i == 0 or (i + 1) % 10 == 0 or i == loop_count - 1:
+                execution_state.set_progress(f"[ループクリック] {i + 1}/{loop_count}回完了 (成功: {success_count}, 失敗: {fail_count})")
+
+            # 最後のループ以外は間隔待機（中止されたらすぐ抜ける）
+            if i < loop_count - 1 and execution_state.abort_event.wait(loop_interval):
+                return {"status": "aborted", "message": f"[ループクリック] {i+1}/{loop_count}回で中止 (成功: {success_count}, 失敗: {fail_count})"}
 
     return {"status": "success", "message": f"[ループクリック] {loop_count}回完了 (成功: {success_count}, 失敗: {fail_count})"}
 
 
 # 後方互換性のため古いAPIも残す
-class ClickRequest(BaseModel):
+class ClickRequest(ExecuteSettings):
     image_names: list[str]
-    interval: float = DEFAULT_CLICK_INTERVAL
     confidence: float = 0.8
 
 
 @app.post("/api/click")
 async def execute_clicks(request: ClickRequest):
     """画像を順番にクリックする（後方互換）"""
-    actions = [ActionItem(type="click", image_name=name) for name in request.image_names]
-    exec_request = ExecuteRequest(
-        actions=actions,
-        interval=request.interval,
-        confidence=request.confidence
-    )
-    return await execute_actions(exec_request)
+    # 検証済みの画像名からアクション辞書を直接作る（ActionItem/ExecuteRequestで再検証しない）
+    actions = [{"type": "click", "image_name": name} for name in request.image_names]
+    return start_execution(actions, request)
 
 
 # ログ保存API
 class LogRequest(BaseModel):
     log: str
 
+
+log_queue: asyncio.Queue | None = None  # /api/logのログの書き込み待ち（lifespanで作成）
+
+
+async def flush_log_queue():
+    """/api/logのログをLOG_FLUSH_DELAY秒分ずつまとめて1回の書き込みで追記する"""
+    batch = []
+    try:
+        while True:
+            batch.append(await log_queue.get())
+            await asyncio.sleep(LOG_FLUSH_DELAY)  # 続けて届くログを待って一緒に書く
+            while not log_queue.empty():
+                batch.append(log_queue.get_nowait())
+            count, content, batch = len(batch), "".join(batch), []
+            try:
+                await asyncio.to_thread(append_to_file, LOG_FILE, content, keep_open=True)
+            except Exception as e:
+                # 書き込みに失敗しても書き込み係は止めない（止まると以降のログが溜まり続けるだけになる）
+                print(f"[ERROR] ログの書き込みに失敗しました（{count}件）: {type(e).__name__}: {e}")
+    finally:
+        # 終了時は待ち中のログを書き切る
+        while not log_queue.empty():
+            batch.append(log_queue.get_nowait())
+        if batch:
+            append_to_file(LOG_FILE, "".join(batch), keep_open=True)
+
+
 @app.post("/api/log")
 async def save_log(request: LogRequest):
-    """ログをファイルに追記"""
-    from datetime import datetime
+    """ログを書き込み待ちに積む（ファイルへの追記はflush_log_queueがまとめて行う）"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"\n{'='*60}\n")
-        f.write(f"[{timestamp}]\n")
-        f.write(request.log)
-        f.write("\n")
+    log_queue.put_nowait(f"\n{'='*60}\n[{timestamp}]\n{request.log}\n")
     return {"success": True}
 
 
+class ImageFiles(StaticFiles):
+    """画像の静的配信（?v=更新時刻 付きのURLは内容が変わらないので長期キャッシュさせる）"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if b"v=" in scope.get("query_string", b""):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"  # バージョンなしのURLは毎回ETagで確認する
+        return response
+
+
 # 画像ファイルを静的ファイルとして配信
-app.mount("/images", StaticFiles(directory=str(IMAGES_DIR)), name="images")
+app.mount("/images", ImageFiles(directory=str(IMAGES_DIR)), name="images")
 
 
 if __name__ == "__main__":